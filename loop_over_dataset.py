@@ -21,6 +21,7 @@ import numpy as np
 import math
 import cv2
 import matplotlib.pyplot as plt
+import itertools
 import copy
 
 ## Add current working directory to path
@@ -37,6 +38,10 @@ import student.objdet_eval as eval
 
 import misc.objdet_tools as tools 
 from misc.helpers import save_object_to_file, load_object_from_file, make_exec_list
+from misc.frame_pipeline import FramePipeline
+from misc.stage_cache import StageCache
+from misc.observer import AsyncObserver, OBSERVED_VISUALIZATIONS, show_detection_results
+from misc.pcl_preprocessing import preprocess_pcl
 
 ## Tracking
 from student.filter import Filter
@@ -58,14 +63,18 @@ show_only_frames = [0, 200] # show only frames in interval for debugging
 ## Prepare Waymo Open Dataset file for loading
 data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'dataset', data_filename) # adjustable path in case this script is called from another working directory
 results_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'results')
-datafile = WaymoDataFileReader(data_fullpath)
+datafile = WaymoDataFileReader(data_fullpath, use_mmap=True, lazy=True) # frame index is cached next to the file for fast random access, frame fields are decoded on first access
 datafile_iter = iter(datafile)  # initialize dataset iterator
+if show_only_frames[0] < len(datafile):
+    datafile.seek_frame(show_only_frames[0]) # jump directly to the first selected frame
+else:
+    datafile_iter = iter([]) # no selected frame in the file, the loop ends right away
 
 ## Initialize object detection
 configs_det = det.load_configs(model_name='fpn_resnet') # options are 'darknet', 'fpn_resnet'
-model_det = det.create_model(configs_det)
 
 configs_det.use_labels_as_objects = False # True = use groundtruth labels as objects, False = use model-based detection
+configs_det.headless = False # True = bev_from_pcl, detect_objects and the performance measurement open no windows and print nothing; the visualizations run in a background observer (show_pcl is skipped)
 
 ## Uncomment this setting to restrict the y-range in the final project
 # configs_det.lim_y = [-25, 25] 
@@ -85,12 +94,121 @@ exec_tracking = [] # options are 'perform_tracking'
 exec_visualization = [] # options are 'show_range_image', 'show_bev', 'show_pcl', 'show_labels_in_image', 'show_objects_and_labels_in_bev', 'show_objects_in_bev_labels_in_camera', 'show_tracks', 'show_detection_performance', 'make_tracking_movie'
 exec_list = make_exec_list(exec_detection, exec_tracking, exec_visualization)
 vis_pause_time = 0 # set pause time between frames in ms (0 = stop between frames until key is pressed)
+num_decode_workers = 0 # number of worker processes which decode frames and compute point-cloud / bev ahead of time (0 = serial processing)
+detection_batch_size = 1 # > 1 = read this many frames ahead and detect their objects with one forward pass per batch (offline mode)
+use_stage_cache = False # True = compute point-cloud, bev, detections, label validation and performance only if no result for the current configs is in the stage cache (exec_detection is ignored)
+
+## Accumulate the point-clouds of the last configs_det.num_sweeps frames for the birds-eye view
+sweep_accumulator = None
+if configs_det.num_sweeps > 1:
+    sweep_accumulator = tools.SweepAccumulator(configs_det.num_sweeps)
+
+## Decode frames and pre-process lidar data in worker processes while the main loop runs inference
+frame_pipeline = None
+if num_decode_workers > 0 and 'pcl_from_rangeimage' in exec_list:
+    frame_pipeline = FramePipeline(data_fullpath, configs_det, range(show_only_frames[0], min(show_only_frames[1] + 1, len(datafile))),
+                                   num_workers=num_decode_workers, compute_bev='bev_from_pcl' in exec_list and sweep_accumulator is None)
+    frame_pipeline_iter = iter(frame_pipeline)
+
+## Load the detection model after the worker processes have been forked, so that they do not inherit it
+model_det = det.create_model(configs_det)
+
+## Cache the results of the detection stages, keyed by frame, configs and model weights
+## (multi-sweep results depend on the previous frames and are not cached)
+stage_cache = None
+if use_stage_cache and sweep_accumulator is None:
+    stage_cache = StageCache(results_fullpath, data_filename, configs_det)
+
+## Show the detection results in a background thread instead of blocking the loop (headless mode)
+vis_observer = None
+if configs_det.headless and any(vis in exec_list for vis in OBSERVED_VISUALIZATIONS):
+    vis_observer = AsyncObserver(show_detection_results)
+if configs_det.headless and 'show_pcl' in exec_list:
+    print('warning: show_pcl opens a blocking viewer and is skipped in headless mode')
+
+
+## Yields the selected frames with their lidar point-cloud and birds-eye view, in the order of the main loop
+def frame_data():
+    cnt_frame = show_only_frames[0]
+    while True:
+        ## Get next frame from Waymo dataset
+        try:
+            if frame_pipeline is not None:
+                _, frame, lidar_pcl, lidar_bev = next(frame_pipeline_iter)
+            else:
+                frame = next(datafile_iter)
+        except StopIteration:
+            return
+        if cnt_frame > show_only_frames[1]:
+            print('reached end of selected frames')
+            return
+        
+        print('------------------------------')
+        print('processing frame #' + str(cnt_frame))
+
+        ## Compute lidar point-cloud from range image    
+        if frame_pipeline is not None:
+            print('using point-cloud from frame pipeline')
+        elif stage_cache is not None:
+            print('loading lidar point-cloud from stage cache or computing it from lidar range image')
+            lidar_pcl = stage_cache.get_or_compute('lidar_pcl', cnt_frame, lambda: preprocess_pcl(tools.pcl_from_lidars(frame, configs_det.lidar_names, configs_det.lidar_returns), configs_det))
+        elif 'pcl_from_rangeimage' in exec_list:
+            print('computing point-cloud from lidar range image')
+            lidar_pcl = tools.pcl_from_lidars(frame, configs_det.lidar_names, configs_det.lidar_returns)
+            lidar_pcl = preprocess_pcl(lidar_pcl, configs_det) # crop, downsample and remove the ground as selected in configs_det
+        else:
+            print('loading lidar point-cloud from result file')
+            lidar_pcl = load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', cnt_frame)
+            lidar_pcl = preprocess_pcl(lidar_pcl, configs_det)
+            
+        ## Accumulate the point-clouds of the last frames, motion-compensated into the current vehicle frame
+        if sweep_accumulator is not None:
+            sweep_accumulator.add(frame, lidar_pcl)
+            lidar_pcl_bev = sweep_accumulator.points() # last column = time offset to the current frame in s
+            print('accumulated point-clouds of ' + str(len(sweep_accumulator)) + ' frames')
+
+        ## Compute lidar birds-eye view (bev)
+        if sweep_accumulator is not None:
+            print('computing birds-eye view from accumulated lidar pointclouds')
+            lidar_bev = pcl.bev_from_pcl(lidar_pcl_bev, configs_det)
+        elif 'bev_from_pcl' in exec_list and frame_pipeline is not None:
+            print('using birds-eye view from frame pipeline')
+        elif stage_cache is not None:
+            print('loading birds-eye view from stage cache or computing it from lidar pointcloud')
+            lidar_bev = stage_cache.get_or_compute('lidar_bev', cnt_frame, lambda: pcl.bev_from_pcl(lidar_pcl, configs_det))
+        elif 'bev_from_pcl' in exec_list:
+            print('computing birds-eye view from lidar pointcloud')
+            lidar_bev = pcl.bev_from_pcl(lidar_pcl, configs_det)
+        else:
+            print('loading birds-eve view from result file')
+            lidar_bev = load_object_from_file(results_fullpath, data_filename, 'lidar_bev', cnt_frame)
+
+        yield cnt_frame, frame, lidar_pcl, lidar_bev
+        cnt_frame = cnt_frame + 1
+
+## Detects the objects of batches of detection_batch_size frames of frame_data with one forward pass per batch (offline mode)
+## and stores them in batch_detections; only one batch of frames is held in memory
+def detect_in_batches(frames):
+    while True:
+        batch = list(itertools.islice(frames, detection_batch_size))
+        if len(batch) == 0:
+            return
+        print('detecting objects in a batch of ' + str(len(batch)) + ' frames')
+        batch_detections.update(zip([cnt_frame for cnt_frame, _, _, _ in batch],
+                                    det.detect_objects_batch([lidar_bev for _, _, _, lidar_bev in batch], model_det, configs_det)))
+        for data in batch:
+            yield data
+
+frame_data_iter = frame_data()
+batch_detections = None
+if detection_batch_size > 1 and 'detect_objects' in exec_list and configs_det.use_labels_as_objects==False and stage_cache is None:
+    batch_detections = {}
+    frame_data_iter = detect_in_batches(frame_data_iter)
 
 
 ##################
 ## Perform detection & tracking over all selected frames
 
-cnt_frame = 0
 all_labels = []
 det_performance_all = [] 
 np.random.seed(0) # make random values predictable
@@ -99,17 +217,8 @@ if 'show_tracks' in exec_list:
 
 while True:
     try:
-        ## Get next frame from Waymo dataset
-        frame = next(datafile_iter)
-        if cnt_frame < show_only_frames[0]:
-            cnt_frame = cnt_frame + 1
-            continue
-        elif cnt_frame > show_only_frames[1]:
-            print('reached end of selected frames')
-            break
-        
-        print('------------------------------')
-        print('processing frame #' + str(cnt_frame))
+        ## Get next frame from Waymo dataset with its lidar point-cloud and birds-eye view (see frame_data)
+        cnt_frame, frame, lidar_pcl, lidar_bev = next(frame_data_iter)
 
         #################################
         ## Perform 3D object detection
@@ -122,28 +231,18 @@ while True:
         if 'load_image' in exec_list:
             image = tools.extract_front_camera_image(frame) 
 
-        ## Compute lidar point-cloud from range image    
-        if 'pcl_from_rangeimage' in exec_list:
-            print('computing point-cloud from lidar range image')
-            lidar_pcl = tools.pcl_from_range_image(frame, lidar_name)
-        else:
-            print('loading lidar point-cloud from result file')
-            lidar_pcl = load_object_from_file(results_fullpath, data_filename, 'lidar_pcl', cnt_frame)
-            
-        ## Compute lidar birds-eye view (bev)
-        if 'bev_from_pcl' in exec_list:
-            print('computing birds-eye view from lidar pointcloud')
-            lidar_bev = pcl.bev_from_pcl(lidar_pcl, configs_det)
-        else:
-            print('loading birds-eve view from result file')
-            lidar_bev = load_object_from_file(results_fullpath, data_filename, 'lidar_bev', cnt_frame)
-
         ## 3D object detection
         if (configs_det.use_labels_as_objects==True):
             print('using groundtruth labels as objects')
             detections = tools.convert_labels_into_objects(frame.laser_labels, configs_det)
+        elif stage_cache is not None:
+            print('loading detected objects from stage cache or detecting objects in lidar pointcloud')
+            detections = stage_cache.get_or_compute('detections', cnt_frame, lambda: det.detect_objects(lidar_bev, model_det, configs_det))
         else:
-            if 'detect_objects' in exec_list:
+            if batch_detections is not None:
+                print('using detected objects from batch detection')
+                detections = batch_detections.pop(cnt_frame)
+            elif 'detect_objects' in exec_list:
                 print('detecting objects in lidar pointcloud')   
                 detections = det.detect_objects(lidar_bev, model_det, configs_det)
             else:
@@ -155,7 +254,10 @@ while True:
                     detections = load_object_from_file(results_fullpath, data_filename, 'detections_' + configs_det.arch + '_' + str(configs_det.conf_thresh), cnt_frame)
 
         ## Validate object labels
-        if 'validate_object_labels' in exec_list:
+        if stage_cache is not None:
+            print('loading object label validation from stage cache or validating object labels')
+            valid_label_flags = stage_cache.get_or_compute('valid_labels', cnt_frame, lambda: tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs_det, 0 if configs_det.use_labels_as_objects==True else 10))
+        elif 'validate_object_labels' in exec_list:
             print("validating object labels")
             valid_label_flags = tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs_det, 0 if configs_det.use_labels_as_objects==True else 10)
         else:
@@ -163,9 +265,12 @@ while True:
             valid_label_flags = load_object_from_file(results_fullpath, data_filename, 'valid_labels', cnt_frame)            
 
         ## Performance evaluation for object detection
-        if 'measure_detection_performance' in exec_list:
+        if stage_cache is not None and configs_det.use_labels_as_objects==False:
+            print('loading detection performance measures from stage cache or measuring detection performance')
+            det_performance = stage_cache.get_or_compute('det_performance', cnt_frame, lambda: eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs_det.min_iou, not configs_det.headless))
+        elif 'measure_detection_performance' in exec_list:
             print('measuring detection performance')
-            det_performance = eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs_det.min_iou)     
+            det_performance = eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs_det.min_iou, not configs_det.headless)     
         else:
             print('loading detection performance measures from file')
             # load different data for final project vs. mid-term project
@@ -177,30 +282,35 @@ while True:
         det_performance_all.append(det_performance) # store all evaluation results in a list for performance assessment at the end
         
 
-        ## Visualization for object detection
-        if 'show_range_image' in exec_list:
+        ## Visualization for object detection (in headless mode by the observer, without waiting for a key)
+        if vis_observer is not None:
+            vis_observer.submit(cnt_frame, exec_list=exec_list, configs=configs_det, frame=frame, lidar_bev=lidar_bev,
+                                detections=detections, valid_label_flags=valid_label_flags, camera_calibration=camera_calibration,
+                                image=image if 'load_image' in exec_list else None)
+
+        if 'show_range_image' in exec_list and vis_observer is None:
             img_range = pcl.show_range_image(frame, lidar_name)
             img_range = img_range.astype(np.uint8)
             cv2.imshow('range_image', img_range)
             cv2.waitKey(vis_pause_time)
 
-        if 'show_pcl' in exec_list:
+        if 'show_pcl' in exec_list and not configs_det.headless:
             pcl.show_pcl(lidar_pcl)
 
-        if 'show_bev' in exec_list:
+        if 'show_bev' in exec_list and vis_observer is None:
             tools.show_bev(lidar_bev, configs_det)  
             cv2.waitKey(vis_pause_time)          
 
-        if 'show_labels_in_image' in exec_list:
+        if 'show_labels_in_image' in exec_list and vis_observer is None:
             img_labels = tools.project_labels_into_camera(camera_calibration, image, frame.laser_labels, valid_label_flags, 0.5)
             cv2.imshow('img_labels', img_labels)
             cv2.waitKey(vis_pause_time)
 
-        if 'show_objects_and_labels_in_bev' in exec_list:
+        if 'show_objects_and_labels_in_bev' in exec_list and vis_observer is None:
             tools.show_objects_labels_in_bev(detections, frame.laser_labels, lidar_bev, configs_det)
             cv2.waitKey(vis_pause_time)         
 
-        if 'show_objects_in_bev_labels_in_camera' in exec_list:
+        if 'show_objects_in_bev_labels_in_camera' in exec_list and vis_observer is None:
             tools.show_objects_in_bev_labels_in_camera(detections, lidar_bev, image, frame.laser_labels, valid_label_flags, camera_calibration, configs_det)
             cv2.waitKey(vis_pause_time)               
 
@@ -263,9 +373,6 @@ while True:
                     print('Saving frame', fname)
                     fig.savefig(fname)
 
-        # increment frame counter
-        cnt_frame = cnt_frame + 1    
-
     except StopIteration:
         # if StopIteration is raised, break from loop
         print("StopIteration has been raised\n")
@@ -275,6 +382,14 @@ while True:
 #################################
 ## Post-processing
 
+## Wait for the background visualization
+if vis_observer is not None:
+    vis_observer.close()
+
+## Stop the worker processes of the frame pipeline
+if frame_pipeline is not None:
+    frame_pipeline.close()
+
 ## Evaluate object detection performance
 if 'show_detection_performance' in exec_list:
     eval.compute_performance_stats(det_performance_all)
@@ -0,0 +1,96 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Evaluate object detection on all sequences of the dataset with several worker processes
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# general package imports
+import copy
+import multiprocessing
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+## Waymo open dataset reader
+from tools.waymo_reader.simple_waymo_open_dataset_reader.catalog import DatasetCatalog
+
+
+# run detection and performance measurement on one shard of the dataset
+def evaluate_shard(catalog, shard_id, num_shards, configs, num_threads=1):
+    import torch
+    import student.objdet_pcl as pcl
+    import student.objdet_detect as det
+    import student.objdet_eval as eval
+    import misc.objdet_tools as tools
+    from misc.pcl_preprocessing import preprocess_pcl
+
+    # shards run side by side: no windows and no console output per frame (BevBuilder has no visualization)
+    configs = copy.copy(configs)
+    configs.headless = True
+
+    torch.set_num_threads(num_threads)
+    model = det.create_model(configs)
+    bev_builder = pcl.BevBuilder(configs, pinMemory=True)
+
+    results = []
+    for segment, frame_id, frame in catalog.iter_shard(shard_id, num_shards):
+        lidar_pcl = preprocess_pcl(tools.pcl_from_lidars(frame, configs.lidar_names, configs.lidar_returns), configs)
+        lidar_bev = bev_builder.build(lidar_pcl)
+        detections = det.detect_objects(lidar_bev, model, configs)
+        valid_label_flags = tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs, 10)
+        det_performance = eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags, configs.min_iou,
+                                                                 verbose=False)
+        results.append((segment, frame_id, det_performance))
+
+    return results
+
+
+def _evaluate_shard_task(args):
+    return evaluate_shard(*args)
+
+
+# evaluate object detection on all frames of all sequences in a directory
+def evaluate_dataset(dataset_path, configs, num_workers=None):
+    '''Split all frames of all sequences in dataset_path into num_workers disjoint shards,
+    evaluate each shard in its own process and merge the results.
+
+    Returns the list of det_performance entries of all frames, ordered by sequence and frame,
+    which can be passed to objdet_eval.compute_performance_stats. The shards are processed headless
+    (no windows, no console output per frame, see evaluate_shard).
+    '''
+
+    catalog = DatasetCatalog(dataset_path)
+    num_workers = num_workers or os.cpu_count()
+    num_threads = max(1, os.cpu_count() // num_workers)
+    tasks = [(catalog, shard_id, num_workers, configs, num_threads) for shard_id in range(num_workers)]
+
+    if num_workers == 1:
+        shard_results = [_evaluate_shard_task(tasks[0])]
+    else:
+        # fork where available so that the workers do not re-import the calling script
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        with multiprocessing.get_context(method).Pool(num_workers) as pool:
+            shard_results = pool.map(_evaluate_shard_task, tasks)
+
+    # shards are contiguous, so concatenating them in shard order keeps sequence and frame order
+    return [det_performance for results in shard_results for _, _, det_performance in results]
+
+
+if __name__ == '__main__':
+    import student.objdet_detect as det
+    import student.objdet_eval as eval
+
+    configs_det = det.load_configs(model_name='fpn_resnet') # options are 'darknet', 'fpn_resnet'
+    dataset_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'dataset')
+    det_performance_all = evaluate_dataset(dataset_path, configs_det)
+    eval.compute_performance_stats(det_performance_all)
@@ -0,0 +1,137 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Compute point-clouds and birds-eye views in a pool of worker processes
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# general package imports
+import collections
+import copy
+import multiprocessing
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+## Waymo open dataset reader
+from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, dataset_pb2
+
+# object detection tools and helper functions
+import misc.objdet_tools as tools
+from misc.pcl_preprocessing import preprocess_pcl
+
+
+# state of the current worker process, set up once by the pool initializer
+_worker_state = {}
+
+
+def _init_worker(data_fullpath, configs, lidar_name, compute_bev):
+    import torch
+    import student.objdet_pcl as pcl
+
+    # workers run side by side, so keep each of them single-threaded
+    torch.set_num_threads(1)
+
+    # workers never open windows or print per frame, whatever the consumer uses
+    configs = copy.copy(configs)
+    configs.headless = True
+
+    _worker_state['reader'] = WaymoDataFileReader(data_fullpath, use_mmap=True, lazy=True)
+    _worker_state['configs'] = configs
+    _worker_state['lidar_name'] = lidar_name
+    # the bev buffers are reused for every frame, BevBuilder has no visualization
+    _worker_state['bev_builder'] = pcl.BevBuilder(configs) if compute_bev else None
+
+
+# decode a single frame and compute its point-cloud and birds-eye view
+def _process_frame(frame_id):
+    frame = _worker_state['reader'].read_frame(frame_id)
+    configs = _worker_state['configs']
+    lidar_names = configs.get('lidar_names', [_worker_state['lidar_name']])
+    lidar_pcl = tools.pcl_from_lidars(frame, lidar_names, configs.get('lidar_returns', [1]))
+    lidar_pcl = preprocess_pcl(lidar_pcl, configs)
+
+    lidar_bev = None
+    if _worker_state['bev_builder'] is not None:
+        # tensors are sent to the consumer through shared memory, so send a copy of the reused buffer
+        lidar_bev = _worker_state['bev_builder'].build(lidar_pcl).clone()
+
+    return frame_id, lidar_pcl, lidar_bev
+
+
+# producer / consumer pipeline which pre-processes frames in worker processes
+class FramePipeline:
+    '''Iterate over frames of a Waymo Open Dataset file while a pool of worker processes
+    computes point-clouds and birds-eye views ahead of time. Each worker decodes the range images
+    of its frames from its own reader. The main process reads the frames it yields from the
+    memory-mapped file without copying; their fields are only decoded when they are accessed.
+
+    Results are returned in frame order. At most `prefetch` frames are in flight, so memory
+    stays bounded while the next birds-eye view is usually ready when the consumer asks for it.
+    Iterating yields tuples (frame_id, frame, lidar_pcl, lidar_bev); lidar_bev is None if
+    compute_bev is False. The point-cloud fuses the lasers and returns in configs.lidar_names and
+    configs.lidar_returns, or the first return of lidar_name if configs does not set them.
+
+    The workers are forked, so create the pipeline before loading large objects such as the
+    detection model, and close() it when done.
+    '''
+
+    def __init__(self, data_fullpath, configs, frame_ids, lidar_name=dataset_pb2.LaserName.TOP,
+                 num_workers=4, prefetch=None, compute_bev=True):
+        self.data_fullpath = data_fullpath
+        self.configs = configs
+        self.frame_ids = list(frame_ids)
+        self.lidar_name = lidar_name
+        self.num_workers = num_workers
+        self.prefetch = prefetch if prefetch is not None else 2 * num_workers
+        self.compute_bev = compute_bev
+
+        # the main process reads the frames itself (zero-copy), only pre-processing results are transferred
+        self.reader = WaymoDataFileReader(data_fullpath, use_mmap=True, lazy=True)
+
+        # fork where available: scripts like loop_over_dataset.py have no __main__ guard and must not be re-imported by workers
+        method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        self.pool = multiprocessing.get_context(method).Pool(
+            num_workers, initializer=_init_worker,
+            initargs=(data_fullpath, configs, lidar_name, compute_bev))
+
+    def __iter__(self):
+        pending = collections.deque()
+        next_ids = iter(self.frame_ids)
+
+        def submit_next():
+            frame_id = next(next_ids, None)
+            if frame_id is not None:
+                pending.append(self.pool.apply_async(_process_frame, (frame_id,)))
+
+        # fill the prefetch queue
+        for _ in range(self.prefetch):
+            submit_next()
+
+        while pending:
+            frame_id, lidar_pcl, lidar_bev = pending.popleft().get()
+
+            # keep the queue filled while the consumer works on the current frame
+            submit_next()
+
+            yield frame_id, self.reader.read_frame(frame_id), lidar_pcl, lidar_bev
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,196 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Store all pre-computed results of a sequence in a single memory-mappable file
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import json
+import mmap
+import os
+import pickle
+import struct
+import numpy as np
+
+STORE_SUFFIX = '.store'
+
+# every block starts with a fixed-size prefix (magic, header length), followed by a json header and the payload
+BLOCK_MAGIC = b'FSB1'
+BLOCK_PREFIX = struct.Struct('<4sI')
+ALIGNMENT = 64
+
+# payload kinds
+KIND_ARRAY = 'array'    # numpy array, stored as raw bytes
+KIND_TENSOR = 'tensor'  # torch tensor, stored as raw bytes of its numpy array
+KIND_PICKLE = 'pickle'  # any other (small) object, e.g. lists of detections, labels or performance measures
+
+
+## Returns the path of the store file of a sequence
+def store_filename(file_path, base_filename):
+    return os.path.join(file_path, os.path.splitext(base_filename)[0] + STORE_SUFFIX)
+
+
+## Append-only file holding the results of all frames of one sequence
+class FrameStore:
+    '''Single-file store for the per-frame results of one sequence (point-clouds, bev maps, detections, ...).
+
+    Each call to append() adds a block (object name, frame id, payload) at the end of the file.
+    Arrays and tensors are stored as raw, 64-byte aligned bytes, all other objects are pickled.
+    The file is memory-mapped for reading: arrays are returned as read-only views without copying,
+    tensors are copied into new tensors. If a frame is appended twice, the last block wins.
+    Only one process at a time may append to a store.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index = {} # (object_name, frame_id) -> block header
+        self.mmap = None
+        self.size = 0
+        if os.path.exists(filename):
+            self._scan()
+
+    def close(self):
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # views of the mapped arrays are still in use, the mapping is released with them
+                pass
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, key):
+        if key not in self.index:
+            self.refresh()
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def object_names(self):
+        return sorted(set(name for name, _ in self.index))
+
+    def frame_ids(self, object_name):
+        return sorted(frame_id for name, frame_id in self.index if name == object_name)
+
+    ## Picks up the blocks appended by other store instances of the same file
+    def refresh(self):
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) != self.size:
+            self._scan()
+
+    # read the headers of all blocks after self.size, skipping the payloads
+    def _scan(self):
+        with open(self.filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            pos = self.size
+            while pos + BLOCK_PREFIX.size <= size:
+                f.seek(pos)
+                magic, header_len = BLOCK_PREFIX.unpack(f.read(BLOCK_PREFIX.size))
+                if magic != BLOCK_MAGIC:
+                    raise IOError('Corrupt frame store {} at offset {}'.format(self.filename, pos))
+                if pos + BLOCK_PREFIX.size + header_len > size:
+                    # partially written block at the end of the file, e.g. after a crash
+                    break
+                header = json.loads(f.read(header_len).decode('utf-8'))
+                end = header['offset'] + header['size']
+                if end > size:
+                    break
+                self.index[(header['name'], header['frame'])] = header
+                pos = end
+        self.size = pos
+
+    ## Appends an object of a frame to the store
+    def append(self, object_name, frame_id, object):
+        kind = KIND_PICKLE
+        dtype = None
+        shape = None
+        if isinstance(object, np.ndarray) and not object.dtype.hasobject:
+            kind = KIND_ARRAY
+        elif type(object).__module__.startswith('torch') and hasattr(object, 'numpy'):
+            kind = KIND_TENSOR
+            object = object.detach().cpu().numpy()
+
+        if kind == KIND_PICKLE:
+            payload = pickle.dumps(object, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            object = np.ascontiguousarray(object)
+            dtype, shape = object.dtype.str, list(object.shape)
+            payload = memoryview(object).cast('B')
+
+        header = {'name': object_name, 'frame': frame_id, 'kind': kind, 'dtype': dtype, 'shape': shape, 'size': len(payload)}
+
+        self.refresh()
+
+        with open(self.filename, 'ab') as f:
+            # drop a partially written block at the end of the file
+            f.truncate(self.size)
+            pos = self.size
+            # the payload offset depends on the header length, which depends on the offset => iterate until stable
+            offset = pos
+            while True:
+                header['offset'] = offset
+                header_bytes = json.dumps(header).encode('utf-8')
+                start = pos + BLOCK_PREFIX.size + len(header_bytes)
+                new_offset = (start + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+                if new_offset == offset:
+                    break
+                offset = new_offset
+            f.write(BLOCK_PREFIX.pack(BLOCK_MAGIC, len(header_bytes) + offset - start))
+            f.write(header_bytes)
+            f.write(b' ' * (offset - start)) # pad the json header with white space
+            f.write(payload)
+            self.size = f.tell()
+
+        self.index[(object_name, frame_id)] = header
+
+    def _buffer(self, end):
+        # (re)map the file if blocks were appended since it was mapped
+        if self.mmap is None or len(self.mmap) < end:
+            self.close()
+            with open(self.filename, 'rb') as f:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmap
+
+    ## Loads an object of a frame from the store, raises KeyError if it is not stored
+    def load(self, object_name, frame_id):
+        header = self.index[(object_name, frame_id)]
+        buffer = self._buffer(header['offset'] + header['size'])
+
+        if header['kind'] == KIND_PICKLE:
+            return pickle.loads(buffer[header['offset']:header['offset'] + header['size']])
+
+        dtype = np.dtype(header['dtype'])
+        array = np.frombuffer(buffer, dtype=dtype, count=header['size'] // dtype.itemsize,
+                              offset=header['offset']).reshape(header['shape'])
+        if header['kind'] == KIND_TENSOR:
+            import torch
+            return torch.from_numpy(array.copy())
+        return array
+
+    ## Loads an object for all frames (or the given frames) in one go, returns a dict frame_id -> object
+    def load_all(self, object_name, frame_ids=None):
+        if frame_ids is None:
+            frame_ids = self.frame_ids(object_name)
+        return {frame_id: self.load(object_name, frame_id) for frame_id in frame_ids}
+
+
+# open stores, shared by all calls of save_object / load_object
+_stores = {}
+
+## Returns the (cached) store of a sequence
+def get_store(file_path, base_filename):
+    filename = store_filename(file_path, base_filename)
+    if filename not in _stores:
+        _stores[filename] = FrameStore(filename)
+    return _stores[filename]
@@ -14,20 +14,41 @@
 import os
 import pickle
 
-## Saves an object to a binary file
+# add project directory to python path to enable relative imports
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+import misc.frame_store as frame_store
+
+## Saves an object to the result store of the sequence (see misc/frame_store.py)
 def save_object_to_file(object, file_path, base_filename, object_name, frame_id=1):
-    object_filename = os.path.join(file_path, os.path.splitext(base_filename)[0]
-                                   + "__frame-" + str(frame_id) + "__" + object_name + ".pkl")
-    with open(object_filename, 'wb') as f:
-        pickle.dump(object, f)
+    frame_store.get_store(file_path, base_filename).append(object_name, frame_id, object)
 
-## Loads an object from a binary file
+## Loads an object from the result store of the sequence or, if it is not stored there, from a binary file
 def load_object_from_file(file_path, base_filename, object_name, frame_id=1):
+    store = frame_store.get_store(file_path, base_filename)
+    if (object_name, frame_id) in store:
+        return store.load(object_name, frame_id)
+
     object_filename = os.path.join(file_path, os.path.splitext(base_filename)[0]
                                    + "__frame-" + str(frame_id) + "__" + object_name + ".pkl")
     with open(object_filename, 'rb') as f:
         object = pickle.load(f)
         return object
+
+## Converts all binary files of a sequence into its result store
+def convert_result_files(file_path, base_filename):
+    prefix = os.path.splitext(base_filename)[0] + "__frame-"
+    store = frame_store.get_store(file_path, base_filename)
+    for filename in sorted(os.listdir(file_path)):
+        if filename.startswith(prefix) and filename.endswith(".pkl"):
+            frame_id, object_name = filename[len(prefix):-len(".pkl")].split("__", 1)
+            if (object_name, int(frame_id)) not in store:
+                with open(os.path.join(file_path, filename), 'rb') as f:
+                    store.append(object_name, int(frame_id), pickle.load(f))
+    return store
     
 ## Prepares an exec_list with all tasks to be executed
 def make_exec_list(exec_detection, exec_tracking, exec_visualization): 
@@ -0,0 +1,117 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Export the detection models as frozen TorchScript graphs and load them again
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import inspect
+import json
+import torch
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from misc.stage_cache import file_digest
+
+COMPILED_SUFFIX = '.torchscript.pt'
+SIGNATURE_FILE = 'signature.json'
+FORMAT_VERSION = 1 # increase when the export changes
+
+# configs entries which define the network of each architecture
+ARCH_CONFIGS = {
+    'darknet': ['cfgfile', 'use_giou_loss'],
+    'fpn_resnet': ['num_layers', 'heads', 'head_conv'],
+}
+
+
+## Returns the path of the exported model, next to the weights in pretrained/
+## (variant names a modified model, e.g. a quantized one, exported from the same weights)
+def compiled_model_filename(configs, variant=None):
+    base = os.path.splitext(configs.pretrained_filename)[0]
+    if variant is not None:
+        base += '_' + variant
+    return '{}_{}_{}x{}{}'.format(base, torch.device(configs.device).type, configs.bev_height, configs.bev_width, COMPILED_SUFFIX)
+
+
+## Returns everything the exported graph depends on: architecture, weights, model sources, input size, device
+def model_signature(configs, model_class, variant=None):
+    arch = 'darknet' if configs.arch == 'darknet' else 'fpn_resnet'
+    sources = [inspect.getsourcefile(model_class)]
+    if arch == 'darknet':
+        sources.append(configs.cfgfile)
+        sources.append(inspect.getsourcefile(sys.modules[model_class.__module__].YoloLayer))
+    return {
+        'format': FORMAT_VERSION,
+        'arch': configs.arch,
+        'variant': variant,
+        'configs': {name: configs.get(name) for name in ARCH_CONFIGS[arch]},
+        'weights': file_digest(configs.pretrained_filename),
+        'sources': [file_digest(source) for source in sources],
+        'input': [3, configs.bev_height, configs.bev_width],
+        'device': torch.device(configs.device).type,
+        'torch': torch.__version__,
+    }
+
+
+## Traces an eager model with a birds-eye view of the size in configs, freezes it and saves it
+def export_model(model, configs, filename=None, model_class=None, variant=None):
+    '''Trace the model (in eval mode, on configs.device) with an empty birds-eye view and freeze the graph:
+    the weights become constants, batch norms are folded into the convolutions and the Python control flow
+    of the forward pass (e.g. the block interpretation of Darknet) is gone. Branches on the input size are
+    recorded for the size in configs, which is part of the file name; the graph works for any batch size.
+    The signature of the model (model_class: class of the eager network, if model wraps it) is stored
+    in the file, so load_compiled_model can detect stale exports.
+    Returns the frozen model.
+    '''
+
+    filename = filename or compiled_model_filename(configs, variant)
+    example = torch.zeros((1, 3, configs.bev_height, configs.bev_width), device=configs.device)
+
+    model.eval()
+    with torch.no_grad():
+        model(example) # lazily initialized state (grid offsets of the yolo layers) is set before tracing
+        traced = torch.jit.trace(model, example, strict=False) # strict=False: fpn_resnet returns a dict of heads
+        frozen = torch.jit.freeze(traced)
+
+    signature = json.dumps(model_signature(configs, model_class or type(model), variant), sort_keys=True, default=str)
+    torch.jit.save(frozen, filename, _extra_files={SIGNATURE_FILE: signature})
+    return frozen
+
+
+## Loads the exported model if it exists and matches the current configs, weights and model sources, else returns None
+def load_compiled_model(configs, model_class, filename=None, variant=None):
+    filename = filename or compiled_model_filename(configs, variant)
+    if not os.path.isfile(filename):
+        return None
+
+    extra_files = {SIGNATURE_FILE: ''}
+    model = torch.jit.load(filename, map_location=configs.device, _extra_files=extra_files)
+    signature = json.dumps(model_signature(configs, model_class, variant), sort_keys=True, default=str)
+    stored = extra_files[SIGNATURE_FILE]
+    if (stored.decode('utf-8') if isinstance(stored, bytes) else stored) != signature:
+        return None
+    return model
+
+
+if __name__ == '__main__':
+    import student.objdet_detect as det
+
+    for model_name in ['fpn_resnet', 'darknet']:
+        configs = det.load_configs(model_name=model_name)
+        if not os.path.isfile(configs.pretrained_filename):
+            print('No weights at {}, skipping {}'.format(configs.pretrained_filename, model_name))
+            continue
+        configs.use_compiled_model = False
+        export_model(det.create_model(configs), configs)
+        print('Exported {} to {}'.format(model_name, compiled_model_filename(configs)))
@@ -0,0 +1,88 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Fold the batch norms of the detection models into their convolutions for inference
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import copy
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+
+def _foldable(conv, bn):
+    return isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d) and bn.track_running_stats
+
+
+## Folds every batch norm into the convolution it directly follows, in place; returns the number of folded batch norms
+def fold_batch_norms(model):
+    '''Replace each pair conv -> batch norm by a single convolution with the normalization folded into its
+    weights and bias (only valid in eval mode, the model is switched to it). Pairs are
+    - consecutive layers of an nn.Sequential (convolutional blocks of Darknet, downsample branches of ResNet),
+      the batch norm is removed from the container
+    - attributes convN and bnN of the same module (stem and blocks of ResNet), which call them one after
+      the other; the batch norm is replaced by nn.Identity
+    The activations are already applied in place by both models, so they are left as they are.
+    '''
+
+    model.eval()
+    num_folded = 0
+    for module in list(model.modules()):
+        if isinstance(module, nn.Sequential):
+            names = list(module._modules.keys())
+            for conv_name, bn_name in zip(names[:-1], names[1:]):
+                if conv_name in module._modules and _foldable(module._modules[conv_name], module._modules[bn_name]):
+                    module._modules[conv_name] = fuse_conv_bn_eval(module._modules[conv_name], module._modules[bn_name])
+                    del module._modules[bn_name]
+                    num_folded += 1
+        else:
+            for conv_name, conv in list(module.named_children()):
+                bn_name = 'bn' + conv_name[len('conv'):]
+                if conv_name.startswith('conv') and _foldable(conv, getattr(module, bn_name, None)):
+                    setattr(module, conv_name, fuse_conv_bn_eval(conv, getattr(module, bn_name)))
+                    setattr(module, bn_name, nn.Identity())
+                    num_folded += 1
+    return num_folded
+
+
+## Returns the tensors of a model output (tensor, tuple / list or dict of tensors) as a flat list
+def _output_tensors(output):
+    if isinstance(output, torch.Tensor):
+        return [output]
+    if isinstance(output, dict):
+        return [tensor for key in sorted(output) for tensor in _output_tensors(output[key])]
+    if isinstance(output, (list, tuple)):
+        return [tensor for item in output for tensor in _output_tensors(item)]
+    return []
+
+
+## Returns a copy of the model with folded batch norms if it computes the same outputs as the model, else the model itself
+def fold_batch_norms_checked(model, configs, rtol=1e-3, atol=1e-4):
+    '''Fold the batch norms of a copy of the model and compare the outputs of both on a random,
+    sparse birds-eye view of the size in configs (fixed seed). The unchanged model is returned
+    if the outputs differ by more than rtol / atol or if there is nothing to fold.
+    '''
+
+    folded = copy.deepcopy(model)
+    if fold_batch_norms(folded) == 0:
+        return model
+
+    generator = torch.Generator().manual_seed(0)
+    bev = torch.rand((1, 3, configs.bev_height, configs.bev_width), generator=generator)
+    bev *= torch.rand((1, 1, configs.bev_height, configs.bev_width), generator=generator) < 0.1
+    bev = bev.to(configs.device)
+    with torch.no_grad():
+        expected = _output_tensors(model.eval()(bev))
+        actual = _output_tensors(folded(bev))
+
+    if len(expected) != len(actual) or not all(torch.allclose(a, e, rtol=rtol, atol=atol) for a, e in zip(actual, expected)):
+        print('Folded batch norms change the model outputs, using the model as it is')
+        return model
+    return folded
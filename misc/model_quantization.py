@@ -0,0 +1,218 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Quantize the detection model to int8 for CPU inference and compare its accuracy with fp32
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import copy
+import functools
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from misc.frame_store import get_store
+from misc.helpers import load_object_from_file
+from misc.model_export import export_model, load_compiled_model
+from misc.stage_cache import CACHE_SUFFIX, StageCache
+from tools.objdet_models.resnet.models.fpn_resnet import PoseResNet
+
+
+## Backbone, feature pyramid and heads of fpn_resnet as a module which can be traced symbolically
+class _FpnOutputs(nn.Module):
+    def __init__(self, model):
+        super(_FpnOutputs, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_fpn(x)
+
+
+## fpn_resnet with an int8 backbone, feature pyramid and heads
+class QuantizedFpnResnet(nn.Module):
+    '''Runs the quantized part of fpn_resnet (all convolutions, with batch norms and relus fused into them)
+    and merges the dequantized outputs of the pyramid levels in fp32, like PoseResNet.forward.
+    Takes and returns the same tensors as the fp32 model.
+    '''
+
+    def __init__(self, fpn):
+        super(QuantizedFpnResnet, self).__init__()
+        self.fpn = fpn
+
+    def forward(self, x):
+        _, _, input_h, input_w = x.size()
+        return PoseResNet.merge_fpn_outputs(self.fpn(x), input_h // 4, input_w // 4)
+
+
+## Raises a ValueError if the installed torch has no int8 kernels for configs.quantization_backend
+def check_backend(configs):
+    if configs.quantization_backend not in torch.backends.quantized.supported_engines:
+        raise ValueError("Quantization backend '{}' is not supported by this torch version (supported: {})".format(
+            configs.quantization_backend, torch.backends.quantized.supported_engines))
+
+
+## Returns the name under which the quantized model is exported (see misc/model_export.py)
+def quantized_variant(configs):
+    return 'int8_' + configs.quantization_backend
+
+
+## Returns up to num_frames cached birds-eye views of a sequence, evenly spaced over the sequence
+def calibration_bevs(results_path, data_filename, configs, num_frames):
+    '''Collect the birds-eye views of the size in configs, at most one per frame, from the stage cache of the
+    sequence (only the entries for the current configs) and from its pre-computed results (result store or
+    binary files). The views are filtered before they are sampled, so num_frames views are returned if that
+    many frames have one. Nothing is written: the stores are only read and the binary files are not imported
+    into the result store.
+    '''
+
+    shape = (3, configs.bev_height, configs.bev_width)
+    def has_shape(bev):
+        return tuple(bev.shape[-3:]) == shape and bev.numel() == np.prod(shape)
+
+    loaders = {} # frame id -> function which loads the birds-eye view of the frame
+
+    # stage cache entries are named 'lidar_bev-<key>', the key covers the configs the birds-eye view depends on
+    cache_filename = os.path.join(results_path, os.path.splitext(os.path.basename(data_filename))[0] + CACHE_SUFFIX)
+    if os.path.isfile(cache_filename):
+        cache = StageCache(results_path, data_filename, configs)
+        for frame_id in sorted(set(frame_id for object_name in cache.store.object_names() if object_name.startswith('lidar_bev-')
+                                   for frame_id in cache.store.frame_ids(object_name))):
+            if ('lidar_bev', frame_id) in cache:
+                loaders[frame_id] = functools.partial(cache.load, 'lidar_bev', frame_id)
+
+    # pre-computed birds-eye views, in the result store or as binary file (see load_object_from_file),
+    # loaded once to check their size
+    frame_ids = set(get_store(results_path, data_filename).frame_ids('lidar_bev'))
+    prefix = os.path.splitext(data_filename)[0] + '__frame-'
+    suffix = '__lidar_bev.pkl'
+    if os.path.isdir(results_path):
+        frame_ids.update(int(filename[len(prefix):-len(suffix)]) for filename in os.listdir(results_path)
+                         if filename.startswith(prefix) and filename.endswith(suffix))
+    for frame_id in frame_ids - set(loaders):
+        loader = functools.partial(load_object_from_file, results_path, data_filename, 'lidar_bev', frame_id)
+        if has_shape(loader()):
+            loaders[frame_id] = loader
+
+    frame_ids = sorted(loaders)
+    bevs = []
+    for idx in np.unique(np.linspace(0, len(frame_ids) - 1, min(num_frames, len(frame_ids))).astype(int)):
+        bev = loaders[frame_ids[idx]]()
+        if has_shape(bev):
+            bevs.append(bev.reshape(1, *shape).float().cpu())
+    return bevs
+
+
+## Static post-training quantization of fpn_resnet, calibrated on the given birds-eye views
+def quantize_model(model, bevs, configs):
+    '''Fuse conv-bn(-relu), insert observers, run the birds-eye views through the model to calibrate
+    the activation ranges and convert it to int8 with the kernels of configs.quantization_backend.
+    The fp32 model is not modified. Only fpn_resnet on CPU is supported.
+    '''
+
+    if configs.arch != 'fpn_resnet':
+        raise ValueError("Quantization is only supported for fpn_resnet, not for '{}'".format(configs.arch))
+    if torch.device(configs.device).type != 'cpu':
+        raise ValueError('Quantized models only run on the CPU, set configs.no_cuda')
+    if len(bevs) == 0:
+        raise ValueError('No birds-eye views for the calibration')
+    check_backend(configs)
+
+    torch.backends.quantized.engine = configs.quantization_backend
+    fpn = _FpnOutputs(copy.deepcopy(model).cpu().eval())
+    prepared = prepare_fx(fpn, get_default_qconfig_mapping(configs.quantization_backend), (bevs[0],))
+    with torch.no_grad():
+        for bev in bevs:
+            prepared(bev)
+
+    return QuantizedFpnResnet(convert_fx(prepared)).eval()
+
+
+## Quantizes the model, calibrated on the cached birds-eye views of a sequence, and exports it for create_model
+def export_quantized_model(model, results_path, data_filename, configs):
+    bevs = calibration_bevs(results_path, data_filename, configs, configs.num_calibration_frames)
+    quantized = quantize_model(model, bevs, configs)
+    return export_model(quantized, configs, model_class=PoseResNet, variant=quantized_variant(configs))
+
+
+## Loads the exported quantized model if it matches the current configs and weights, else returns None
+def load_quantized_model(configs):
+    check_backend(configs)
+    torch.backends.quantized.engine = configs.quantization_backend
+    return load_compiled_model(configs, PoseResNet, variant=quantized_variant(configs))
+
+
+## Compares precision, recall and latency of the fp32 and the int8 model on frames of a sequence
+def accuracy_report(model_fp32, model_int8, data_fullpath, frame_ids, configs):
+    '''Detect objects in the given frames with both models and evaluate them against the labels with
+    measure_detection_performance and compute_performance_stats. Prints a comparison and returns
+    a dict model name -> (precision, recall, mean latency of the forward pass in s).
+    '''
+
+    import student.objdet_pcl as pcl
+    import student.objdet_detect as det
+    import student.objdet_eval as eval
+    import misc.objdet_tools as tools
+    from misc.pcl_preprocessing import preprocess_pcl
+    from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader
+
+    configs = copy.copy(configs)
+    configs.headless = True
+    datafile = WaymoDataFileReader(data_fullpath, use_mmap=True, lazy=True)
+    bev_builder = pcl.BevBuilder(configs)
+
+    models = {'fp32': model_fp32, 'int8': model_int8}
+    det_performance_all = {name: [] for name in models}
+    latencies = {name: [] for name in models}
+    for frame_id in frame_ids:
+        frame = datafile.read_frame(frame_id)
+        lidar_pcl = preprocess_pcl(tools.pcl_from_lidars(frame, configs.lidar_names, configs.lidar_returns), configs)
+        lidar_bev = bev_builder.build(lidar_pcl)
+        valid_label_flags = tools.validate_object_labels(frame.laser_labels, lidar_pcl, configs, 10)
+        for name, model in models.items():
+            start = time.perf_counter()
+            detections = det.detect_objects(lidar_bev, model, configs)
+            latencies[name].append(time.perf_counter() - start)
+            det_performance_all[name].append(eval.measure_detection_performance(detections, frame.laser_labels, valid_label_flags,
+                                                                                configs.min_iou, verbose=False))
+
+    report = {}
+    for name in models:
+        precision, recall = eval.compute_performance_stats(det_performance_all[name], plot=False)
+        report[name] = (float(precision), float(recall), float(np.mean(latencies[name])))
+
+    print('model  precision  recall  latency')
+    for name, (precision, recall, latency) in report.items():
+        print('{:5}  {:9.4f}  {:6.4f}  {:6.3f} s'.format(name, precision, recall, latency))
+    return report
+
+
+if __name__ == '__main__':
+    import student.objdet_detect as det
+
+    data_filename = 'training_segment-1005081002024129653_5313_150_5333_150_with_camera_labels.tfrecord' # Sequence 1
+    report_frames = range(0, 200, 5) # frames of the accuracy report
+    results_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'results')
+    data_fullpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'dataset', data_filename)
+
+    configs_det = det.load_configs(model_name='fpn_resnet')
+    configs_det.use_compiled_model = False
+    configs_det.use_quantized_model = False
+    model_fp32 = det.create_model(configs_det)
+    model_int8 = export_quantized_model(model_fp32, results_path, data_filename, configs_det)
+    accuracy_report(model_fp32, model_int8, data_fullpath, report_frames, configs_det)
@@ -17,6 +17,7 @@
 import cv2
 import numpy as np
 import math
+import collections
 from shapely.geometry import Polygon
 
 # add project directory to python path to enable relative imports
@@ -30,6 +31,9 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 from tools.waymo_reader.simple_waymo_open_dataset_reader import utils as waymo_utils
 from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, dataset_pb2, label_pb2
 
+## point-cloud preprocessing
+from misc.pcl_preprocessing import VOXEL_COUNT
+
 
 
 ##################
@@ -47,43 +51,6 @@ def compute_beam_inclinations(calibration, height):
         return np.linspace(inclination_min, inclination_max, height)
 
 
-def compute_range_image_polar(range_image, extrinsic, inclination):
-    """ Convert a range image to polar coordinates. """
-
-    height = range_image.shape[0]
-    width = range_image.shape[1]
-
-    az_correction = math.atan2(extrinsic[1,0], extrinsic[0,0])
-    azimuth = np.linspace(np.pi,-np.pi,width) - az_correction
-
-    azimuth_tiled = np.broadcast_to(azimuth[np.newaxis,:], (height,width))
-    inclination_tiled = np.broadcast_to(inclination[:,np.newaxis],(height,width))
-
-    return np.stack((azimuth_tiled,inclination_tiled,range_image))
-
-
-def compute_range_image_cartesian(range_image_polar, extrinsic, pixel_pose, frame_pose):
-    """ Convert polar coordinates to cartesian coordinates. """
-
-    azimuth = range_image_polar[0]
-    inclination = range_image_polar[1]
-    range_image_range = range_image_polar[2]
-
-    cos_azimuth = np.cos(azimuth)
-    sin_azimuth = np.sin(azimuth)
-    cos_incl = np.cos(inclination)
-    sin_incl = np.sin(inclination)
-
-    x = cos_azimuth * cos_incl * range_image_range
-    y = sin_azimuth * cos_incl * range_image_range
-    z = sin_incl * range_image_range
-
-    range_image_points = np.stack([x,y,z,np.ones_like(z)])
-    range_image_points = np.einsum('ij,jkl->ikl', extrinsic,range_image_points)
-
-    return range_image_points
-
-
 def get_rotation_matrix(roll, pitch, yaw):
     """ Convert Euler angles to a rotation matrix"""
 
@@ -117,31 +84,57 @@ def get_rotation_matrix(roll, pitch, yaw):
     return pose
 
 
-def project_to_pointcloud(frame, ri, camera_projection, range_image_pose, calibration):
-    """ Create a pointcloud in vehicle space from LIDAR range image. """
-    beam_inclinations = compute_beam_inclinations(calibration, ri.shape[0])
+# per-(segment, laser) geometry of the range image pixels, see get_range_image_geometry
+RangeImageGeometry = collections.namedtuple('RangeImageGeometry', ['calibration', 'shape', 'directions', 'translation',
+                                                                   'directions_f32', 'translation_f32'])
+_range_image_geometries = collections.OrderedDict()
+MAX_RANGE_IMAGE_GEOMETRIES = 64
+
+
+def compute_range_image_geometry(calibration, height, width):
+    """ Compute the unit direction vector of every range image pixel in vehicle space. """
+
+    beam_inclinations = compute_beam_inclinations(calibration, height)
     beam_inclinations = np.flip(beam_inclinations)
 
     extrinsic = np.array(calibration.extrinsic.transform).reshape(4,4)
-    frame_pose = np.array(frame.pose.transform).reshape(4,4)
 
-    ri_polar = compute_range_image_polar(ri[:,:,0], extrinsic, beam_inclinations)
+    az_correction = math.atan2(extrinsic[1,0], extrinsic[0,0])
+    azimuth = np.linspace(np.pi,-np.pi,width) - az_correction
+
+    # outer products of the per-column azimuth and per-row inclination terms, (height, width) each
+    cos_incl = np.cos(beam_inclinations)[:,np.newaxis]
+    directions = np.stack([
+        cos_incl * np.cos(azimuth)[np.newaxis,:],
+        cos_incl * np.sin(azimuth)[np.newaxis,:],
+        np.broadcast_to(np.sin(beam_inclinations)[:,np.newaxis], (height,width))], axis=-1)
+
+    # rotate into vehicle space, the translation is added after scaling with the range
+    directions = directions @ extrinsic[:3,:3].T
+
+    return np.ascontiguousarray(directions), extrinsic[:3,3].copy()
+
 
-    #    if range_image_pose is None:
-    #        pixel_pose = None
-    #    else:
-    #        pixel_pose = get_rotation_matrix(range_image_pose[:,:,0], range_image_pose[:,:,1], range_image_pose[:,:,2])
-    #        translation = range_image_pose[:,:,3:]
-    #        pixel_pose = np.block([
-    #            [pixel_pose, translation[:,:,:,np.newaxis]],
-    #            [np.zeros_like(translation)[:,:,np.newaxis],np.ones_like(translation[:,:,0])[:,:,np.newaxis,np.newaxis]]])
+def get_range_image_geometry(frame, calibration, height, width):
+    """ Return the pixel directions of a laser, cached per segment and laser.
 
-    ri_cartesian = compute_range_image_cartesian(ri_polar, extrinsic, None, frame_pose)
-    ri_cartesian = ri_cartesian.transpose(1,2,0)
+    The calibration is constant within a segment, so the directions are computed on the first frame of
+    a segment only. The cached geometry is recomputed if the calibration or the range image size differ.
+    """
 
-    mask = ri[:,:,0] > 0
+    key = (frame.context.name, calibration.name)
+    calibration_bytes = calibration.SerializeToString()
 
-    return ri_cartesian[mask,:3], ri[mask]
+    geometry = _range_image_geometries.get(key)
+    if geometry is None or geometry.calibration != calibration_bytes or geometry.shape != (height, width):
+        directions, translation = compute_range_image_geometry(calibration, height, width)
+        geometry = RangeImageGeometry(calibration_bytes, (height, width), directions, translation,
+                                      directions.astype(np.float32), translation.astype(np.float32))
+        _range_image_geometries[key] = geometry
+        while len(_range_image_geometries) > MAX_RANGE_IMAGE_GEOMETRIES:
+            _range_image_geometries.popitem(last=False)
+
+    return geometry
 
 
 def display_laser_on_image(img, pcl, vehicle_to_image):
@@ -174,23 +167,172 @@ def display_laser_on_image(img, pcl, vehicle_to_image):
     for i in range(proj_pcl.shape[0]):
         cv2.circle(img, (int(proj_pcl[i,0]),int(proj_pcl[i,1])), 1, coloured_intensity[i])
 
+# channels of a range image, see dataset.proto
+RANGE_IMAGE_CHANNELS = {'range': 0, 'intensity': 1, 'elongation': 2, 'no_label_zone': 3}
+
+
+def extract_pointcloud(frame, ri, calibration, attributes=('intensity',), dtype=np.float32):
+    """ Convert the valid pixels (range > 0) of a range image into a point cloud in vehicle space.
+
+    The valid pixels are compacted first, so only they are transformed. Returns a contiguous (N, 3 + k)
+    array of dtype with the columns x, y, z followed by the k range image channels named in attributes
+    (see RANGE_IMAGE_CHANNELS).
+    """
+
+    geometry = get_range_image_geometry(frame, calibration, ri.shape[0], ri.shape[1])
+    if np.dtype(dtype) == np.float32:
+        directions, translation = geometry.directions_f32, geometry.translation_f32
+    else:
+        directions, translation = geometry.directions, geometry.translation
+
+    ri = ri.reshape(-1, ri.shape[2])
+    idx = np.flatnonzero(ri[:,0] > 0)
+    valid = ri[idx]
+
+    points = np.empty((len(idx), 3 + len(attributes)), dtype=dtype)
+    np.multiply(directions.reshape(-1, 3)[idx], valid[:,0:1], out=points[:,:3], casting='unsafe')
+    points[:,:3] += translation
+    for i, attribute in enumerate(attributes):
+        points[:,3+i] = valid[:,RANGE_IMAGE_CHANNELS[attribute]]
+
+    return points
+
+
 # get lidar point cloud from frame
-def pcl_from_range_image(frame, lidar_name):
+def pcl_from_range_image(frame, lidar_name, attributes=('intensity',), dtype=np.float32):
 
     # extract lidar data and range image
     lidar = waymo_utils.get(frame.lasers, lidar_name)
-    range_image, camera_projection, range_image_pose = waymo_utils.parse_range_image_and_camera_projection(lidar)    # Parse the top laser range image and get the associated projection.
+    range_image, camera_projection, range_image_pose = waymo_utils.parse_range_image_and_camera_projection(lidar, frame=frame)    # Parse the top laser range image and get the associated projection.
 
-    # Convert the range image to a point cloud
+    # Convert the range image to a point cloud with columns x, y, z and the lidar intensity (+ further attributes)
     lidar_calib = waymo_utils.get(frame.context.laser_calibrations, lidar_name)
-    pcl, pcl_attr = project_to_pointcloud(frame, range_image, camera_projection, range_image_pose, lidar_calib)
-
-    # stack point cloud and lidar intensity
-    points_all = np.column_stack((pcl, pcl_attr[:, 1]))
+    points_all = extract_pointcloud(frame, range_image, lidar_calib, attributes, dtype)
 
     return points_all
 
 
+# get fused lidar point cloud of several lasers and returns from frame
+def pcl_from_lidars(frame, lidar_names=None, returns=(1,), attributes=('intensity',), dtype=np.float32, return_tags=False):
+    """ Merge the point clouds of several lasers and returns into a single point cloud in vehicle space.
+
+    lidar_names: names of the lasers to fuse (dataset_pb2.LaserName), all lasers of the frame if None.
+    returns: range image returns to fuse, 1 = strongest return, 2 = second strongest return.
+
+    The valid pixels of all range images are gathered first, then all points are computed with a single
+    multiply-add. Returns a contiguous (N, 3 + k) array of dtype as extract_pointcloud, and if return_tags
+    is set, also a (N, 2) uint8 array with the laser name and the return of each point.
+    """
+
+    if lidar_names is None:
+        lidar_names = [lidar.name for lidar in frame.lasers]
+
+    float32 = np.dtype(dtype) == np.float32
+    directions, ranges, values, translations, tags, counts = [], [], [], [], [], []
+
+    for lidar_name in lidar_names:
+        lidar = waymo_utils.get(frame.lasers, lidar_name)
+        lidar_calib = waymo_utils.get(frame.context.laser_calibrations, lidar_name)
+
+        for ret in returns:
+            ri, _, _ = waymo_utils.parse_range_image_and_camera_projection(lidar, second_response=(ret == 2), frame=frame)
+            if ri is None:
+                continue
+
+            geometry = get_range_image_geometry(frame, lidar_calib, ri.shape[0], ri.shape[1])
+            ri = ri.reshape(-1, ri.shape[2])
+            idx = np.flatnonzero(ri[:,0] > 0)
+            valid = ri[idx]
+
+            directions.append((geometry.directions_f32 if float32 else geometry.directions).reshape(-1, 3)[idx])
+            ranges.append(valid[:,0])
+            values.append(valid[:,[RANGE_IMAGE_CHANNELS[attribute] for attribute in attributes]])
+            translations.append(geometry.translation_f32 if float32 else geometry.translation)
+            tags.append((lidar_name, ret))
+            counts.append(len(idx))
+
+    if not counts:
+        points = np.zeros((0, 3 + len(attributes)), dtype=dtype)
+        return (points, np.zeros((0, 2), dtype=np.uint8)) if return_tags else points
+
+    # one fused multiply-add over the valid pixels of all range images
+    points = np.empty((sum(counts), 3 + len(attributes)), dtype=dtype)
+    np.multiply(np.concatenate(directions), np.concatenate(ranges)[:,np.newaxis], out=points[:,:3], casting='unsafe')
+    points[:,:3] += np.repeat(np.array(translations, dtype=dtype), counts, axis=0)
+    points[:,3:] = np.concatenate(values)
+
+    if return_tags:
+        return points, np.repeat(np.array(tags, dtype=np.uint8), counts, axis=0)
+    return points
+
+
+class SweepAccumulator:
+    """ Ring buffer of the point clouds of the last num_sweeps frames of a segment, motion-compensated
+    into the vehicle frame of the newest frame with frame.pose (vehicle to world transform).
+
+    Whenever a frame is added, the stored sweeps are moved from the previous into the new vehicle frame
+    with a single rigid transform, so previous frames are never decoded again. Only static objects are
+    compensated, moving objects leave a trail. The buffer is cleared when the segment changes or the
+    timestamps do not increase, e.g. after seeking in the dataset.
+    """
+
+    def __init__(self, num_sweeps=3, max_age=None):
+        self.num_sweeps = num_sweeps
+        self.max_age = max_age # sweeps older than max_age seconds are left out of points(), None = no limit
+        self.sweeps = collections.deque(maxlen=num_sweeps) # (points in the current vehicle frame, timestamp_micros)
+        self.segment = None
+        self.pose = None
+        self.timestamp = None
+
+    def __len__(self):
+        return len(self.sweeps)
+
+    def reset(self):
+        self.sweeps.clear()
+        self.segment = None
+        self.pose = None
+        self.timestamp = None
+
+    def add(self, frame, pcl):
+        """ Add the point cloud (N, 3 + k) of a frame, in the vehicle frame of that frame. The array is copied. """
+
+        pose = np.array(frame.pose.transform, dtype=np.float64).reshape(4,4)
+        if frame.context.name != self.segment or self.timestamp is None or frame.timestamp_micros <= self.timestamp:
+            self.reset()
+
+        if self.sweeps:
+            # previous vehicle frame -> world -> current vehicle frame
+            delta = np.linalg.solve(pose, self.pose)
+            rotation = delta[:3,:3].T
+            translation = delta[:3,3]
+            for points, _ in self.sweeps:
+                xyz = points[:,:3]
+                xyz[...] = xyz @ rotation.astype(points.dtype) + translation.astype(points.dtype)
+
+        self.sweeps.append((np.array(pcl, copy=True), frame.timestamp_micros))
+        self.segment = frame.context.name
+        self.pose = pose
+        self.timestamp = frame.timestamp_micros
+
+    def points(self):
+        """ Return the accumulated point cloud, newest sweep first, with the time offset of each point
+        to the newest sweep in seconds (>= 0) appended as last column. """
+
+        sweeps = [(points, (self.timestamp - timestamp) * 1e-6) for points, timestamp in reversed(self.sweeps)]
+        if self.max_age is not None:
+            sweeps = [(points, dt) for points, dt in sweeps if dt <= self.max_age]
+        if not sweeps:
+            return None
+
+        result = np.empty((sum(len(points) for points, _ in sweeps), sweeps[0][0].shape[1] + 1), dtype=sweeps[0][0].dtype)
+        start = 0
+        for points, dt in sweeps:
+            result[start:start + len(points), :-1] = points
+            result[start:start + len(points), -1] = dt
+            start += len(points)
+        return result
+
+
 
 
 ##################
@@ -256,7 +398,10 @@ def validate_object_labels(object_labels, pcl, configs, min_num_points):
     proj_pcl = np.einsum('lij,bj->lbi', vehicle_to_labels, pcl1) # transform point cloud to label space for each label (proj_pcl shape is [label, LIDAR point, coordinates])
     mask = np.logical_and.reduce(np.logical_and(proj_pcl >= -1, proj_pcl <= 1), axis=2) # for each pair of LIDAR point & label, check if point is inside the label's box (mask shape is [label, LIDAR point])
 
-    counts = mask.sum(1) # count points inside each label's box and keep boxes which contain min. no of points
+    if configs.get('voxel_size') is not None:
+        counts = mask @ pcl[:, VOXEL_COUNT] # a voxelized point-cloud stores the number of points of each voxel
+    else:
+        counts = mask.sum(1) # count points inside each label's box and keep boxes which contain min. no of points
     valid_flags = counts >= min_num_points
 
     ## Mark labels as invalid which are ...
@@ -0,0 +1,114 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Run visualization asynchronously, outside of the processing loop
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import queue
+import threading
+
+# marks the end of the frames in the queue of an observer
+_STOP = object()
+
+
+## Calls a visualization function for every submitted frame in a background thread
+class AsyncObserver:
+    '''Receives the results of each frame from the processing loop and passes them to
+    callback(frame_id, **data) in a background thread, so that visualization never blocks processing.
+
+    At most max_pending frames wait in the queue. If the callback falls behind, the oldest waiting
+    frame is dropped instead of blocking submit(). All calls of the callback happen in the same thread,
+    so GUI toolkits which must be used from a single thread (OpenCV windows) work as long as the main
+    thread does not open windows itself. The first exception raised by the callback is re-raised by close().
+    '''
+
+    def __init__(self, callback, max_pending=2):
+        self.callback = callback
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            if self.error is not None:
+                continue
+            frame_id, data = item
+            try:
+                self.callback(frame_id, **data)
+            except Exception as error:
+                self.error = error
+
+    ## Passes the results of a frame to the observer without waiting for the callback
+    def submit(self, frame_id, **data):
+        while True:
+            try:
+                self.queue.put_nowait((frame_id, data))
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    ## Waits until all submitted frames are processed and stops the background thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_STOP)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# visualizations of the processing loop which an observer can show (show_pcl opens a blocking viewer)
+OBSERVED_VISUALIZATIONS = ['show_range_image', 'show_bev', 'show_labels_in_image', 'show_objects_and_labels_in_bev',
+                           'show_objects_in_bev_labels_in_camera']
+
+
+## Observer callback: shows the visualizations of the detection results of a frame which are selected in exec_list
+def show_detection_results(frame_id, exec_list, configs, frame=None, lidar_bev=None, detections=None,
+                           valid_label_flags=None, image=None, camera_calibration=None, **data):
+    import cv2
+    import numpy as np
+    import misc.objdet_tools as tools
+    import student.objdet_pcl as pcl
+    from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+
+    if 'show_range_image' in exec_list:
+        cv2.imshow('range_image', pcl.show_range_image(frame, dataset_pb2.LaserName.TOP).astype(np.uint8))
+
+    if 'show_bev' in exec_list:
+        # bev_from_pcl shows the intensity and height layers only outside of headless mode
+        tools.show_bev(lidar_bev, configs)
+        cv2.imshow('Intensity Image', lidar_bev[0, 0].numpy())
+        cv2.imshow('Height Image', lidar_bev[0, 1].numpy())
+
+    if 'show_labels_in_image' in exec_list:
+        cv2.imshow('img_labels', tools.project_labels_into_camera(camera_calibration, image, frame.laser_labels, valid_label_flags, 0.5))
+
+    if 'show_objects_and_labels_in_bev' in exec_list:
+        tools.show_objects_labels_in_bev(detections, frame.laser_labels, lidar_bev, configs)
+
+    if 'show_objects_in_bev_labels_in_camera' in exec_list:
+        tools.show_objects_in_bev_labels_in_camera(detections, lidar_bev, image, frame.laser_labels, valid_label_flags,
+                                                   camera_calibration, configs)
+
+    cv2.waitKey(1) # let OpenCV draw the windows
@@ -0,0 +1,208 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Reduce the lidar point-cloud before birds-eye view and label validation
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import numpy as np
+
+# columns appended to the point-cloud by voxel_grid
+VOXEL_COUNT = 4       # number of points in the voxel
+VOXEL_MAX_HEIGHT = 5  # height of the highest point in the voxel
+
+# odd 64 bit multipliers of the voxel hash, a new one is used for each round of collision resolution
+_HASH_MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93]
+
+
+## Removes all points outside the detection area (lim_x, lim_y, lim_z) with a single copy
+def crop_to_roi(pcl, configs):
+    x, y, z = pcl[:, 0], pcl[:, 1], pcl[:, 2]
+    mask = (x >= configs.lim_x[0]) & (x <= configs.lim_x[1])
+    mask &= (y >= configs.lim_y[0]) & (y <= configs.lim_y[1])
+    mask &= (z >= configs.lim_z[0]) & (z <= configs.lim_z[1])
+    return pcl[mask]
+
+
+## Returns the voxel / grid cell index of each point along the given columns, numbered from 0 to num_cells - 1
+def _cell_index(pcl, cell_size, columns):
+    cells = np.zeros(len(pcl), dtype=np.int64)
+    num_cells = 1
+    for column in columns:
+        idx = np.floor(pcl[:, column] / cell_size).astype(np.int64)
+        idx -= idx.min()
+        size = int(idx.max()) + 1
+        cells = cells * size + idx
+        num_cells *= size
+    return cells, num_cells
+
+
+## Numbers the distinct keys from 0 to num_groups - 1 in expected O(N) with a vectorized hash table
+def _group_keys(keys):
+    groups = np.empty(len(keys), dtype=np.int64)
+    remaining = np.arange(len(keys))
+    num_groups = 0
+    rounds = 0
+    while len(remaining):
+        # table with at least twice as many slots as keys; the slots holding a single distinct key are final,
+        # the keys of colliding slots are hashed again in the next round
+        bits = max(4, (2 * len(remaining) - 1).bit_length())
+        multiplier = np.uint64(_HASH_MULTIPLIERS[rounds % len(_HASH_MULTIPLIERS)] + 2 * (rounds // len(_HASH_MULTIPLIERS)))
+        k = keys[remaining]
+        slots = ((k.astype(np.uint64) * multiplier) >> np.uint64(64 - bits)).astype(np.int64)
+
+        lowest = np.full(1 << bits, np.iinfo(np.int64).max)
+        highest = np.full(1 << bits, np.iinfo(np.int64).min)
+        np.minimum.at(lowest, slots, k)
+        np.maximum.at(highest, slots, k)
+        unique = lowest == highest
+
+        ids = np.cumsum(unique) - 1 + num_groups
+        resolved = unique[slots]
+        groups[remaining[resolved]] = ids[slots[resolved]]
+        num_groups += int(unique.sum())
+        remaining = remaining[~resolved]
+        rounds += 1
+
+    return groups, num_groups
+
+
+## Reduces the point-cloud to one point per voxel in O(N)
+def voxel_grid(pcl, voxel_size):
+    '''Group the points into voxels of voxel_size (scalar or (x, y, z) edge lengths in m, z = None for
+    pillars covering the whole height) and keep the point with the highest intensity (column 3) of each
+    voxel, the first one in case of ties, in the original point order.
+
+    The number of points (VOXEL_COUNT) and the height of the highest point (VOXEL_MAX_HEIGHT) of each voxel
+    are appended as columns. With pillars of the size of the bev cells, the highest intensity, its height and
+    the number of points per bev cell are preserved, so the bev map does not change, provided that the
+    point-cloud is cropped to the detection area first (a pillar covers points above and below lim_z).
+    '''
+
+    if np.isscalar(voxel_size):
+        voxel_size = (voxel_size, voxel_size, voxel_size)
+
+    if len(pcl) == 0:
+        return np.zeros((0, pcl.shape[1] + 2), dtype=pcl.dtype)
+
+    # linear voxel index, bev-style discretization: floor(coordinate / size)
+    keys = np.zeros(len(pcl), dtype=np.int64)
+    for column, size in enumerate(voxel_size):
+        if size is None:
+            continue
+        idx = np.floor(pcl[:, column] / size).astype(np.int64)
+        idx -= idx.min()
+        keys = keys * (int(idx.max()) + 1) + idx
+
+    groups, num_groups = _group_keys(keys)
+
+    counts = np.bincount(groups, minlength=num_groups)
+    max_heights = np.full(num_groups, -np.inf)
+    np.maximum.at(max_heights, groups, pcl[:, 2])
+
+    # smallest point index among the points with the highest intensity of their voxel
+    intensity = pcl[:, 3]
+    max_intensity = np.full(num_groups, -np.inf)
+    np.maximum.at(max_intensity, groups, intensity)
+    candidates = np.flatnonzero(intensity == max_intensity[groups])
+    top = np.full(num_groups, len(pcl), dtype=np.int64)
+    np.minimum.at(top, groups[candidates], candidates)
+
+    # keep the original point order
+    keep = np.zeros(len(pcl), dtype=bool)
+    keep[top] = True
+    keep = np.flatnonzero(keep)
+
+    result = np.empty((len(keep), pcl.shape[1] + 2), dtype=pcl.dtype)
+    result[:, :pcl.shape[1]] = pcl[keep]
+    result[:, VOXEL_COUNT] = counts[groups[keep]]
+    result[:, VOXEL_MAX_HEIGHT] = max_heights[groups[keep]]
+    return result
+
+
+## Flags the points within threshold of the lowest point of their grid cell as ground,
+## if the lowest point is below max_z (cells containing only obstacles keep their points)
+def ground_mask_grid(pcl, cell_size=1.0, threshold=0.2, max_z=0.5):
+    if len(pcl) == 0:
+        return np.zeros(0, dtype=bool)
+
+    cells, num_cells = _cell_index(pcl, cell_size, (0, 1))
+    lowest = np.full(num_cells, np.inf)
+    np.minimum.at(lowest, cells, pcl[:, 2].astype(np.float64))
+    lowest = lowest[cells]
+    return (pcl[:, 2] - lowest < threshold) & (lowest < max_z)
+
+
+## Flags the points within threshold of a ground plane as ground. The plane is fitted with RANSAC
+## on a random subsample of the points below max_z and refined with least squares on its inliers.
+def ground_mask_ransac(pcl, threshold=0.2, max_z=0.5, num_iterations=100, num_samples=2000, max_slope=15.0, seed=0):
+    candidates = np.flatnonzero(pcl[:, 2] < max_z)
+    if len(candidates) < 3:
+        return np.zeros(len(pcl), dtype=bool)
+
+    # fixed seed: the same point-cloud always gives the same ground
+    rng = np.random.default_rng(seed)
+    sample = pcl[rng.choice(candidates, min(num_samples, len(candidates)), replace=False), :3].astype(np.float64)
+
+    # one plane hypothesis through three random points per iteration, all evaluated at once
+    triangles = sample[rng.integers(0, len(sample), (num_iterations, 3))]
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1)
+    valid = lengths > 1e-9
+    normals = normals[valid] / lengths[valid, np.newaxis]
+
+    # the ground is roughly horizontal
+    horizontal = np.abs(normals[:, 2]) >= np.cos(np.radians(max_slope))
+    if not horizontal.any():
+        return np.zeros(len(pcl), dtype=bool)
+    normals = normals[horizontal]
+    offsets = -np.einsum('ij,ij->i', normals, triangles[valid][horizontal, 0])
+
+    inliers = np.abs(sample @ normals.T + offsets) < threshold # (sample points, hypotheses)
+    best = inliers[:, inliers.sum(0).argmax()]
+
+    # least squares fit z = a * x + b * y + c to the inliers of the best hypothesis
+    pts = sample[best]
+    A = np.column_stack((pts[:, 0], pts[:, 1], np.ones(len(pts))))
+    (a, b, c), _, _, _ = np.linalg.lstsq(A, pts[:, 2], rcond=None)
+
+    distances = (pcl[:, 2] - (a * pcl[:, 0] + b * pcl[:, 1] + c)) / np.sqrt(a * a + b * b + 1.0)
+    return np.abs(distances) < threshold
+
+
+## Applies the preprocessing steps selected in configs (see load_configs in student/objdet_detect.py)
+def preprocess_pcl(pcl, configs):
+    '''Crop the point-cloud to the detection area, downsample it and remove the ground, as selected
+    by configs.pcl_crop, configs.voxel_size (edge length(s) in m or 'bev' for pillars of the bev cell size)
+    and configs.ground_removal ('grid' or 'ransac'). With 'bev' the point-cloud is always cropped, so that
+    the bev map is the same as without downsampling.
+    Returns pcl itself if no step is selected. The steps are applied once, at the creation of the
+    point-cloud: the ground removal is not idempotent.
+    '''
+
+    voxel_size = configs.get('voxel_size')
+    if configs.get('pcl_crop', False) or voxel_size == 'bev':
+        pcl = crop_to_roi(pcl, configs)
+
+    if voxel_size == 'bev':
+        # pillars of the size of the bev cells
+        voxel_size = ((configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height,
+                      (configs.lim_y[1] - configs.lim_y[0]) / configs.bev_width, None)
+    if voxel_size is not None:
+        pcl = voxel_grid(pcl, voxel_size)
+
+    ground_removal = configs.get('ground_removal')
+    if ground_removal == 'grid':
+        pcl = pcl[~ground_mask_grid(pcl, configs.ground_cell_size, configs.ground_threshold, configs.ground_max_z)]
+    elif ground_removal == 'ransac':
+        pcl = pcl[~ground_mask_ransac(pcl, configs.ground_threshold, configs.ground_max_z)]
+    elif ground_removal is not None:
+        raise ValueError("Unknown ground removal method '{}'".format(ground_removal))
+
+    return pcl
@@ -0,0 +1,122 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Run the detection model only on the occupied parts of the birds-eye view
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import weakref
+import torch
+
+DENSITY_CHANNEL = 2 # channel of the birds-eye view with the point density (see bev_from_pcl)
+OUTPUT_STRIDE = 4   # pixels of the birds-eye view per pixel of the fpn_resnet outputs
+
+# outputs of each model for an empty birds-eye view, keyed by input shape
+_empty_outputs = weakref.WeakKeyDictionary()
+
+
+## Returns the outputs of the model for an empty birds-eye view of the given shape (computed once per model and shape)
+def empty_outputs(model, shape, device):
+    outputs = _empty_outputs.setdefault(model, {})
+    if shape not in outputs:
+        outputs[shape] = model(torch.zeros((1,) + shape, device=device))
+    return outputs[shape]
+
+
+## Returns the start of the windows of size window which contain the tiles of size tile with a margin of halo pixels
+def _window_starts(length, tile, halo, window):
+    starts = []
+    for tile_start in range(0, length, tile):
+        # the windows have the same size (to be batched) and stay inside the birds-eye view
+        starts.append((tile_start, min(tile_start + tile, length), max(0, min(tile_start - halo, length - window))))
+    return starts
+
+
+## Runs the model on the tiles of the birds-eye views which contain points and stitches the outputs together
+def _forward_tiles(model, input_bev_maps, configs, outputs):
+    _, _, height, width = input_bev_maps.shape
+    tile, halo = configs.sparse_tile_size, configs.sparse_halo
+    window_h, window_w = min(tile + 2 * halo, height), min(tile + 2 * halo, width)
+    occupied = input_bev_maps[:, DENSITY_CHANNEL] > 0
+
+    # tiles with points in their window: (sample, tile rows and window row, tile columns and window column)
+    tiles = [(sample, rows, cols)
+             for sample in range(len(input_bev_maps))
+             for rows in _window_starts(height, tile, halo, window_h)
+             for cols in _window_starts(width, tile, halo, window_w)
+             if occupied[sample, rows[2]:rows[2] + window_h, cols[2]:cols[2] + window_w].any()]
+
+    # windows covering more pixels than the birds-eye views themselves are slower than dense inference
+    if len(tiles) * window_h * window_w >= input_bev_maps.shape[0] * height * width:
+        outputs.update(model(input_bev_maps))
+        return
+
+    for start in range(0, len(tiles), configs.sparse_batch_size):
+        batch = tiles[start:start + configs.sparse_batch_size]
+        windows = torch.stack([input_bev_maps[sample, :, rows[2]:rows[2] + window_h, cols[2]:cols[2] + window_w]
+                               for sample, rows, cols in batch])
+        tile_outputs = model(windows)
+
+        # keep the outputs of the tile itself, without the halo
+        for i, (sample, (r0, r1, wr), (c0, c1, wc)) in enumerate(batch):
+            for head in outputs:
+                outputs[head][sample, :, r0 // OUTPUT_STRIDE:r1 // OUTPUT_STRIDE, c0 // OUTPUT_STRIDE:c1 // OUTPUT_STRIDE] = \
+                    tile_outputs[head][i, :, (r0 - wr) // OUTPUT_STRIDE:(r1 - wr) // OUTPUT_STRIDE,
+                                       (c0 - wc) // OUTPUT_STRIDE:(c1 - wc) // OUTPUT_STRIDE]
+
+
+## Runs the model on the bounding box of the points of each birds-eye view, extended by the halo
+def _forward_crops(model, input_bev_maps, configs, outputs):
+    _, _, height, width = input_bev_maps.shape
+    align = 8 * OUTPUT_STRIDE # the crops start and end on the grid of the coarsest feature map (stride 32)
+    for sample in range(len(input_bev_maps)):
+        rows = torch.nonzero(input_bev_maps[sample, DENSITY_CHANNEL].any(dim=1)).flatten()
+        cols = torch.nonzero(input_bev_maps[sample, DENSITY_CHANNEL].any(dim=0)).flatten()
+        if len(rows) == 0:
+            continue
+        r0 = max(0, (int(rows[0]) - configs.sparse_halo) // align * align)
+        c0 = max(0, (int(cols[0]) - configs.sparse_halo) // align * align)
+        r1 = min(height, -(-(int(rows[-1]) + 1 + configs.sparse_halo) // align) * align)
+        c1 = min(width, -(-(int(cols[-1]) + 1 + configs.sparse_halo) // align) * align)
+
+        crop_outputs = model(input_bev_maps[sample:sample + 1, :, r0:r1, c0:c1])
+        for head in outputs:
+            outputs[head][sample, :, r0 // OUTPUT_STRIDE:r1 // OUTPUT_STRIDE, c0 // OUTPUT_STRIDE:c1 // OUTPUT_STRIDE] = \
+                crop_outputs[head][0, :, :(r1 - r0) // OUTPUT_STRIDE, :(c1 - c0) // OUTPUT_STRIDE]
+
+
+## Computes the fpn_resnet outputs of a batch of birds-eye views only where the birds-eye views contain points
+def sparse_forward(model, input_bev_maps, configs):
+    '''Replacement for model(input_bev_maps) which skips the empty parts of the birds-eye views, selected by
+    configs.sparse_inference:
+    - 'tiles': split each birds-eye view into tiles of configs.sparse_tile_size pixels and run the model on the
+      tiles whose window (the tile plus configs.sparse_halo pixels of context on each side) contains points,
+      configs.sparse_batch_size windows per forward pass (dense inference if the windows cover more pixels than
+      the birds-eye views)
+    - 'crop': run the model on the bounding box of the points, extended by configs.sparse_halo pixels
+    The outputs of the skipped parts are those of the model for an empty birds-eye view, which is what the
+    dense model computes far away from any point. Close to points, the outputs differ slightly from dense
+    inference, as the receptive field of the model is larger than the halo. Only fpn_resnet is supported,
+    tile size and halo should be multiples of 32 pixels.
+    '''
+
+    if 'fpn_resnet' not in configs.arch:
+        raise ValueError("Sparse inference is only supported for fpn_resnet, not for '{}'".format(configs.arch))
+
+    empty = empty_outputs(model, tuple(input_bev_maps.shape[1:]), input_bev_maps.device)
+    outputs = {head: empty[head].repeat(len(input_bev_maps), 1, 1, 1) for head in empty}
+
+    if configs.sparse_inference == 'tiles':
+        _forward_tiles(model, input_bev_maps, configs, outputs)
+    elif configs.sparse_inference == 'crop':
+        _forward_crops(model, input_bev_maps, configs, outputs)
+    else:
+        raise ValueError("Unknown sparse inference mode '{}'".format(configs.sparse_inference))
+
+    return outputs
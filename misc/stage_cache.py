@@ -0,0 +1,137 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Cache the results of the object detection stages keyed by a hash of their inputs
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import hashlib
+import json
+import os
+
+# add project directory to python path to enable relative imports
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from misc.frame_store import FrameStore
+
+CACHE_SUFFIX = '.stages.store'
+
+# inputs of each stage: the upstream stages whose results it consumes, the entries of configs_det it depends on
+# and whether it depends on the model weights. Increase the version of a stage when its implementation changes.
+STAGES = {
+    'lidar_pcl': {
+        'upstream': [],
+        'configs': ['lidar_names', 'lidar_returns', 'pcl_crop', 'lim_x', 'lim_y', 'lim_z', 'voxel_size', 'ground_removal',
+                    'ground_cell_size', 'ground_threshold', 'ground_max_z', 'bev_width', 'bev_height'],
+        'weights': False,
+        'version': 3},
+    'lidar_bev': {
+        'upstream': ['lidar_pcl'],
+        'configs': ['lim_x', 'lim_y', 'lim_z', 'lim_r', 'bev_width', 'bev_height', 'approx_percentile'],
+        'weights': False,
+        'version': 1},
+    'detections': {
+        'upstream': ['lidar_bev'],
+        'configs': ['arch', 'conf_thresh', 'nms_thresh', 'lim_x', 'lim_y', 'lim_z', 'bev_width', 'bev_height',
+                    'down_ratio', 'num_layers', 'head_conv', 'heads', 'img_size', 'cfgfile', 'use_quantized_model',
+                    'quantization_backend', 'sparse_inference', 'sparse_tile_size', 'sparse_halo'],
+        'weights': True,
+        'version': 1},
+    'valid_labels': {
+        'upstream': ['lidar_pcl'],
+        'configs': ['lim_x', 'lim_y', 'lim_z', 'use_labels_as_objects'],
+        'weights': False,
+        'version': 1},
+    'det_performance': {
+        'upstream': ['detections', 'valid_labels'],
+        'configs': ['min_iou'],
+        'weights': False,
+        'version': 1},
+}
+
+# digests of weight files, keyed by (path, size, modification time)
+_file_digests = {}
+
+## Returns the sha1 digest of a file, computed once per file version
+def file_digest(path):
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    signature = (path, stat.st_size, stat.st_mtime_ns)
+    if signature not in _file_digests:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        _file_digests[signature] = sha1.hexdigest()
+    return _file_digests[signature]
+
+
+## Content-addressed cache of the detection stage results of one sequence
+class StageCache:
+    '''Cache of the per-frame results of the stages 'lidar_pcl', 'lidar_bev', 'detections', 'valid_labels'
+    and 'det_performance' of one sequence, stored in a FrameStore next to the other results.
+
+    Each result is stored under a key which hashes the sequence, the frame, the config entries the stage
+    depends on, the digest of the model weights (for 'detections') and the keys of its upstream stages.
+    Changing a config entry therefore only invalidates the stages which depend on it and the stages
+    downstream of them; stale results are never returned. The configs are read at every call,
+    so they may be changed between frames.
+    '''
+
+    def __init__(self, results_path, data_filename, configs):
+        self.segment = os.path.basename(data_filename)
+        self.configs = configs
+        self.store = FrameStore(os.path.join(results_path, os.path.splitext(self.segment)[0] + CACHE_SUFFIX))
+        self.hits = 0
+        self.misses = 0
+
+    ## Returns the key of the result of a stage for a frame
+    def key(self, stage, frame_id):
+        desc = STAGES[stage]
+        inputs = {
+            'stage': stage,
+            'version': desc['version'],
+            'segment': self.segment,
+            'frame': frame_id,
+            'configs': {name: self.configs.get(name) for name in desc['configs']},
+            'upstream': [self.key(upstream, frame_id) for upstream in desc['upstream']],
+        }
+        if desc['weights']:
+            inputs['weights'] = file_digest(self.configs.get('pretrained_filename'))
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def _object_name(self, stage, frame_id):
+        return stage + '-' + self.key(stage, frame_id)
+
+    def __contains__(self, stage_frame):
+        stage, frame_id = stage_frame
+        return (self._object_name(stage, frame_id), frame_id) in self.store
+
+    ## Returns the cached result of a stage for a frame, raises KeyError if it is not cached
+    def load(self, stage, frame_id):
+        return self.store.load(self._object_name(stage, frame_id), frame_id)
+
+    ## Returns the cached result of a stage for a frame, or computes it with compute_fn() and caches it
+    def get_or_compute(self, stage, frame_id, compute_fn):
+        object_name = self._object_name(stage, frame_id)
+        if (object_name, frame_id) in self.store:
+            self.hits += 1
+            return self.store.load(object_name, frame_id)
+
+        self.misses += 1
+        result = compute_fn()
+        self.store.append(object_name, frame_id, result)
+        return result
+
+    def close(self):
+        self.store.close()
@@ -30,6 +30,9 @@ from tools.objdet_models.resnet.utils.torch_utils import _sigmoid
 from tools.objdet_models.darknet.models.darknet2pytorch import Darknet as darknet
 from tools.objdet_models.darknet.utils.evaluation_utils import post_processing_v2
 
+# the optional model variants (misc/model_export.py, model_folding.py, model_quantization.py, sparse_inference.py)
+# are imported where they are used, so that they are only needed (with their torch version) if they are selected
+
 
 # load model-related parameters into an edict
 def load_configs_model(model_name='darknet', configs=None):
@@ -92,6 +95,26 @@ def load_configs_model(model_name='darknet', configs=None):
     else:
         raise ValueError("Error: Invalid model name")
 
+    # compiled model (see misc/model_export.py)
+    configs.use_compiled_model = False # True = load the exported TorchScript model next to the weights if it is up to date
+    configs.fold_batch_norms = False # True = fold the batch norms of the eager model into its convolutions at load time (checked against the unfolded model)
+
+    # int8 quantization for CPU inference, fpn_resnet only (see misc/model_quantization.py)
+    configs.use_quantized_model = False # True = run the int8 model exported by misc/model_quantization.py
+    engines = torch.backends.quantized.supported_engines
+    configs.quantization_backend = next((engine for engine in ['x86', 'fbgemm', 'qnnpack'] if engine in engines), None) # int8 kernels: 'x86' (torch >= 2.0) / 'fbgemm' for x86 CPUs, 'qnnpack' for ARM CPUs; default: the first one supported by the installed torch
+    configs.num_calibration_frames = 50 # number of cached birds-eye views used to calibrate the activation ranges
+
+    # inference on the occupied parts of the birds-eye view only, fpn_resnet only (see misc/sparse_inference.py)
+    # off by default, as it trades accuracy for speed: the receptive field of fpn_resnet spans a few hundred pixels,
+    # far more than the halo, so the heatmaps close to the tile / crop borders differ from dense inference and
+    # detections there may move or be lost. A halo as large as the receptive field would make the windows cover
+    # the whole birds-eye view (dense fallback); check the precision / recall before enabling it.
+    configs.sparse_inference = None # None = dense, 'tiles' = tiles with points in their window, 'crop' = bounding box of the points
+    configs.sparse_tile_size = 128 # edge length in pixels of the tiles (multiple of 32)
+    configs.sparse_halo = 32 # pixels of context around the tiles / the bounding box (multiple of 32), larger = closer to dense inference, slower
+    configs.sparse_batch_size = 8 # number of tiles per forward pass
+
     # GPU vs. CPU
     configs.no_cuda = True # if true, cuda is not used
     configs.gpu_idx = 0  # GPU index to use.
@@ -114,6 +137,20 @@ def load_configs(model_name='fpn_resnet', configs=None):
     configs.lim_r = [0, 1.0] # reflected lidar intensity
     configs.bev_width = 608  # pixel resolution of bev image
     configs.bev_height = 608 
+    configs.approx_percentile = False # True = approximate the outlier percentiles of the bev normalization with histograms
+
+    # lidar point-cloud parameters
+    configs.lidar_names = [1] # lasers fused into the point-cloud (see dataset_pb2.LaserName: 1 = TOP, 2 = FRONT, 3 = SIDE_LEFT, 4 = SIDE_RIGHT, 5 = REAR)
+    configs.lidar_returns = [1] # range image returns fused into the point-cloud (1 = strongest return, 2 = second strongest return)
+    configs.num_sweeps = 1 # number of consecutive frames whose point-clouds are accumulated into the bev, motion-compensated with the frame poses
+
+    # lidar point-cloud preprocessing before bev and label validation (see misc/pcl_preprocessing.py)
+    configs.pcl_crop = False # True = remove the points outside lim_x, lim_y and lim_z
+    configs.voxel_size = None # edge length in m of the voxels for downsampling (None = no downsampling)
+    configs.ground_removal = None # None, 'grid' (lowest point per grid cell) or 'ransac' (plane fit on a subsample)
+    configs.ground_cell_size = 1.0 # grid cell size in m of the 'grid' ground removal
+    configs.ground_threshold = 0.2 # max. height in m of ground points above the lowest point of their cell / distance to the ground plane
+    configs.ground_max_z = 0.5 # max. height in m of the ground in vehicle coordinates
 
     # add model-dependent parameters
     configs = load_configs_model(model_name, configs)
@@ -121,6 +158,7 @@ def load_configs(model_name='fpn_resnet', configs=None):
     # visualization parameters
     configs.output_width = 608 # width of result image (height may vary)
     configs.obj_colors = [[0, 255, 255], [0, 0, 255], [255, 0, 0]] # 'Pedestrian': 0, 'Car': 1, 'Cyclist': 2
+    configs.headless = False # True = bev_from_pcl and detect_objects open no windows and print nothing (batch runs)
 
     return configs
 
@@ -131,6 +169,23 @@ def create_model(configs):
     # check for availability of model file
     assert os.path.isfile(configs.pretrained_filename), "No file at {}".format(configs.pretrained_filename)
 
+    # load the quantized model exported from these weights
+    if configs.get('use_quantized_model', False):
+        from misc.model_quantization import load_quantized_model
+        model = load_quantized_model(configs)
+        assert model is not None, "No quantized model for {}, run misc/model_quantization.py".format(configs.pretrained_filename)
+        print('Loaded quantized model for {}\n'.format(configs.pretrained_filename))
+        return model
+
+    # load the exported model instead of building the network, if it matches the weights and configs
+    if configs.get('use_compiled_model', False):
+        from misc.model_export import load_compiled_model
+        model_class = darknet if configs.arch == 'darknet' else fpn_resnet.PoseResNet
+        model = load_compiled_model(configs, model_class)
+        if model is not None:
+            print('Loaded compiled model for {}\n'.format(configs.pretrained_filename))
+            return model
+
     # create model depending on architecture name
     if (configs.arch == 'darknet') and (configs.cfgfile is not None):
         print('using darknet')
@@ -162,25 +217,36 @@ def create_model(configs):
     model = model.to(device=configs.device)  # load model to either cpu or gpu
     model.eval()          
 
+    # fold the batch norms into the preceding convolutions, if this does not change the outputs
+    if configs.get('fold_batch_norms', False):
+        from misc.model_folding import fold_batch_norms_checked
+        model = fold_batch_norms_checked(model, configs)
+
     return model
 
 
-# detect trained objects in birds-eye view
-def detect_objects(input_bev_maps, model, configs):
+# run the model on a batch of birds-eye views and return the raw detections of each of them
+def detectionsFromBevBatch(input_bev_maps, model, configs):
 
     # deactivate autograd engine during test to reduce memory usage and speed up computations
     with torch.no_grad():  
 
-        # perform inference
-        outputs = model(input_bev_maps)
+        # perform inference, on the occupied parts of the birds-eye views only if selected
+        if configs.get('sparse_inference') is not None:
+            from misc.sparse_inference import sparse_forward
+            outputs = sparse_forward(model, input_bev_maps, configs)
+        else:
+            outputs = model(input_bev_maps)
 
         # decode model output into target object format
         if 'darknet' in configs.arch:
 
             # perform post-processing
             output_post = post_processing_v2(outputs, conf_thresh=configs.conf_thresh, nms_thresh=configs.nms_thresh) 
-            detections = []
+            detectionsBatch = []
             for sample_i in range(len(output_post)):
+                detections = []
+                detectionsBatch.append(detections)
                 if output_post[sample_i] is None:
                     continue
                 detection = output_post[sample_i]
@@ -194,7 +260,8 @@ def detect_objects(input_bev_maps, model, configs):
             
             ####### ID_S3_EX1-5 START #######     
             #######
-            print("student task ID_S3_EX1-5")
+            if not configs.get('headless', False):
+                print("student task ID_S3_EX1-5")
 
             # perform post-processing
             output_post = decode(_sigmoid(outputs['hm_cen']),
@@ -208,22 +275,30 @@ def detect_objects(input_bev_maps, model, configs):
             output_post = output_post.cpu().numpy().astype(np.float32)
             output_post = post_processing(output_post, configs)
 
-            detections = []
+            # post_processing returns one dict of detections per class for each birds-eye view of the batch
+            detectionsBatch = []
             for ele in output_post:
+                detections = []
                 for key in ele:
                     if ele[key].size:
                         for detection in ele[key]:
                             detections.append(detection)
+                detectionsBatch.append(detections)
 
             #######
             ####### ID_S3_EX1-5 END #######     
 
-            
+    return detectionsBatch
+
+
+# convert the raw detections of one birds-eye view into objects in vehicle coordinates
+def objectsFromDetections(detections, configs):
 
     ####### ID_S3_EX2 START #######     
     #######
     # Extract 3d bounding boxes from model response
-    print("student task ID_S3_EX2")
+    if not configs.get('headless', False):
+        print("student task ID_S3_EX2")
 
     objects = []
 
@@ -257,3 +332,25 @@ def detect_objects(input_bev_maps, model, configs):
     
     return objects
 
+
+# detect trained objects in birds-eye view
+def detect_objects(input_bev_maps, model, configs):
+    return objectsFromDetections(detectionsFromBevBatch(input_bev_maps, model, configs)[0], configs)
+
+
+# detect trained objects in several birds-eye views with one forward pass
+def detect_objects_batch(input_bev_maps, model, configs, batch_size=None):
+    # input_bev_maps is a list of (1, 3, H, W) or (3, H, W) tensors or a stacked (N, 3, H, W) tensor.
+    # Returns one list of objects per birds-eye view, as detect_objects.
+    # batch_size limits the number of birds-eye views per forward pass (None = all at once).
+    if isinstance(input_bev_maps, (list, tuple)):
+        input_bev_maps = torch.cat([bev_map.reshape(-1, *bev_map.shape[-3:]) for bev_map in input_bev_maps])
+    input_bev_maps = input_bev_maps.to(configs.device)
+
+    batch_size = batch_size or len(input_bev_maps)
+    objectsBatch = []
+    for start in range(0, len(input_bev_maps), batch_size):
+        for detections in detectionsFromBevBatch(input_bev_maps[start:start + batch_size], model, configs):
+            objectsBatch.append(objectsFromDetections(detections, configs))
+
+    return objectsBatch
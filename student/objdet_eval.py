@@ -32,7 +32,8 @@ import misc.objdet_tools as tools
 
 
 # compute various performance measures to assess object detection
-def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5):
+# (verbose = False suppresses all console output, e.g. for batch runs)
+def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5, verbose=True):
     
      # find best detection for each valid label 
     true_positives = 0 # no. of correctly detected objects
@@ -46,7 +47,8 @@ def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5)
 
             ####### ID_S4_EX1 START #######     
             #######
-            print("student task ID_S4_EX1 ")
+            if verbose:
+                print("student task ID_S4_EX1 ")
 
             ## step 1 : extract the four corners of the current label bounding-box
             box = label.box
@@ -91,7 +93,8 @@ def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5)
 
     ####### ID_S4_EX2 START #######     
     #######
-    print("student task ID_S4_EX2")
+    if verbose:
+        print("student task ID_S4_EX2")
     
     # compute positives and negatives for precision/recall
     
@@ -114,7 +117,7 @@ def measure_detection_performance(detections, labels, labels_valid, min_iou=0.5)
 
 
 # evaluate object detection performance based on all frames
-def compute_performance_stats(det_performance_all):
+def compute_performance_stats(det_performance_all, plot=True):
 
     # extract elements
     ious = []
@@ -175,6 +178,9 @@ def compute_performance_stats(det_performance_all):
     mean__devz = np.mean(devs_z_all)
     #std_dev_x = np.std(devs_x)
 
+    if not plot:
+        return precision, recall
+
     # plot results
     data = [precision, recall, ious_all, devs_x_all, devs_y_all, devs_z_all]
     titles = ['detection precision', 'detection recall', 'intersection over union', 'position errors in X', 'position errors in Y', 'position error in Z']
@@ -196,3 +202,5 @@ def compute_performance_stats(det_performance_all):
     plt.tight_layout()
     plt.show()
 
+    return precision, recall
+
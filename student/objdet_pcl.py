@@ -12,10 +12,8 @@
 
 # general package imports
 import cv2
-import open3d as o3d
 import numpy as np
 import torch
-import zlib
 
 # add project directory to python path to enable relative imports
 import os
@@ -30,6 +28,7 @@ from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, lab
 
 # object detection tools and helper functions
 import misc.objdet_tools as tools
+from misc.pcl_preprocessing import VOXEL_COUNT
 
 # Constants to access range image channel dictionary
 RANGE = 0
@@ -49,6 +48,9 @@ def handleRightArrowKey(vis):
 # visualize lidar point-cloud
 def show_pcl(pcl):
     global FRAME_COUNTER
+    # open3d is only needed for the visualization, headless runs work without it
+    import open3d as o3d
+
     ####### ID_S1_EX2 START #######     
     #######
     print("student task ID_S1_EX2")
@@ -99,6 +101,12 @@ def extractLidar(frame, lidar_name):
         # Store lidars in a local variable
         lidars = frame.lasers
 
+        # Lazy frames only parse the requested lidar
+        if hasattr(lidars, 'find_by_name'):
+            lidar = lidars.find_by_name(lidar_name)
+            found = lidar is not None
+            return found, lidar
+
         # Iterate over serialized lidar data
         for l in lidars:
 
@@ -111,7 +119,7 @@ def extractLidar(frame, lidar_name):
 
     return found, lidar
 
-def loadRangeImage(lidar):
+def loadRangeImage(lidar, frame=None):
     # Return variable
     rangeImage = []
 
@@ -122,16 +130,12 @@ def loadRangeImage(lidar):
     # Check if the stream contains data by checking its length
     if (len(rangeImageStream) > 0):
         
-        # Bytestream contains data. Convert return variable
-        # to a float matrix of the dataset_pb2 package
-        rangeImage = dataset_pb2.MatrixFloat()
+        # Decompress and parse the stream into a float matrix. If the frame is given,
+        # the decoded range image is shared with all other consumers via the range image cache
+        rangeImage, _, _ = waymo_utils.parse_range_image_and_camera_projection(lidar, frame=frame)
 
-        # Now we have to parse the stream to be able to process the data
-        rangeImage.ParseFromString(zlib.decompress(rangeImageStream))
-        
-        # Convert data to a numpy array and zero out all negative entries
-        rangeImage = np.array(rangeImage.data).reshape(rangeImage.shape.dims)
-        rangeImage[rangeImage < 0] = 0.0
+        # Zero out all negative entries. The cached range image is read-only, so don't modify it in place
+        rangeImage = np.maximum(rangeImage, 0.0)
 
         # Crop the image from -90 to 90 degrees => 180 degrees
         idxAxisX = rangeImage.shape[1] // 2
@@ -154,15 +158,56 @@ def getRangeImageChannels(rangeImage):
         INSIDE_NO_LABEL_ZONE: rangeImage[:, :, 3]
     }
 
-def handleOutliers(channel, lowerOutlierPercentile = 0, upperOutlierPercentile = 100, scalingTerm = 0.3):
+# Below this number of values per histogram bin, approxPercentiles computes exact percentiles
+MIN_VALUES_PER_BIN = 16
+
+def approxPercentiles(data, percentiles, numBins = 1024):
+    # Approximate percentiles from a histogram with numBins bins between min and max of data.
+    # This avoids partitioning the data. The value of np.percentile lies between the two sorted values
+    # around the rank of the percentile; the approximation lies in the bin of the lower one. So the error
+    # is at most one bin width, i.e. (max - min) / numBins, plus the gap between these two values, which
+    # is large for sparse tails. Small arrays, where such gaps are common, use np.percentile instead.
+    data = np.ravel(data)
+    if len(data) < MIN_VALUES_PER_BIN * numBins:
+        return np.percentile(data, percentiles).astype(data.dtype)
+
+    minVal = data.min()
+    maxVal = data.max()
+    if not (maxVal > minVal):
+        return np.full(len(percentiles), minVal, dtype=data.dtype)
+
+    # Histogram via bincount, the maximum goes into the last bin
+    binWidth = (float(maxVal) - float(minVal)) / numBins
+    binIdx = np.minimum(((data - minVal) / binWidth).astype(np.intp), numBins - 1)
+    cumCounts = np.cumsum(np.bincount(binIdx, minlength=numBins))
+
+    # Rank of each percentile as in np.percentile, then linear interpolation within its bin
+    ranks = np.asarray(percentiles, dtype=np.float64) / 100.0 * (len(data) - 1)
+    bins = np.searchsorted(cumCounts, ranks, side='right')
+    bins = np.minimum(bins, numBins - 1)
+    countsBefore = np.where(bins > 0, cumCounts[bins - 1], 0)
+    countsInBin = np.maximum(cumCounts[bins] - countsBefore, 1)
+    values = float(minVal) + (bins + (ranks - countsBefore + 0.5) / countsInBin) * binWidth
+    return np.clip(values, minVal, maxVal).astype(data.dtype)
+
+def computePercentiles(data, percentiles, approxPercentile = False):
+    # Exact percentiles (np.percentile, which partitions the data) or histogram-based approximation
+    if approxPercentile:
+        return approxPercentiles(data, percentiles)
+    return [np.percentile(data, percentile) for percentile in percentiles]
+
+def handleOutliers(channel, lowerOutlierPercentile = 0, upperOutlierPercentile = 100, scalingTerm = 0.3, inPlace = False, approxPercentile = False):
     # This method will scale outliers to the percentile value while maintaining the relative positions to each other.
     #
     # scalingTerm = 0.3 means:
     # The maximum will be 1.3 * upperPercentile, other upper outliers will be scaled between [upperPercentile, 1.3 * upperPercentile]
     # The minimum will be 0.7 * percentileLower, other lower outliers will be scaled between [0.7 * lowerOutlierPercentile, lowerOutlierPercentile]
+    #
+    # inPlace = True modifies channel instead of a copy
+    # approxPercentile = True uses histogram-based percentiles instead of exact ones
 
     # Save channel in local copy as arrays are mutable. Don't wannt to call by reference
-    channelCpy = channel.copy()
+    channelCpy = channel if inPlace else channel.copy()
 
     # Handle invalid input
     lower = np.max([0, lowerOutlierPercentile])
@@ -172,52 +217,25 @@ def handleOutliers(channel, lowerOutlierPercentile = 0, upperOutlierPercentile =
     # Check if outlier handling is desired.
     if (0 < (upper - lower) < 100):
         # Save percentiles in local variable
-        percentileLower = np.percentile(channelCpy, lower)
-        percentileUpper = np.percentile(channelCpy, upper)
+        percentileLower, percentileUpper = computePercentiles(channelCpy, [lower, upper], approxPercentile)
 
-        # Get indices of outliers. We get a tuple of arrays of same length. 
-        # First array represents: the row index
-        # Second array represents: the col index
-        idxUpper = np.where(channelCpy > percentileUpper)
-        idxLower = np.where(channelCpy < percentileLower)
+        # Get masks of outliers
+        isUpper = channelCpy > percentileUpper
+        isLower = channelCpy < percentileLower
 
         # Compute baseline for scaling
         baseUpper = np.max(channelCpy) - percentileUpper
         baseLower = percentileLower - np.min(channelCpy)
 
-        # Iterate over upper outliers
-        for rowIdx in range(len(idxUpper[0])):
-            
-            # For readablity save indices in local variable
-            iRow = idxUpper[0][rowIdx]
-            iCol = idxUpper[1][rowIdx]
-
-            # Flag indicating negative percentile
-            isNegative = (percentileUpper < 0.0)
-
-            # Compute factor to scale
-            factor = (channelCpy[iRow, iCol] - percentileUpper) / baseUpper
-            factor *= scaleTerm
-
-            # Finally, scale outlier.
-            channelCpy[iRow, iCol] = (percentileUpper * (1.0 - factor)) if isNegative else ((percentileUpper * (1.0 + factor)))
+        # Scale upper outliers
+        factor = (channelCpy[isUpper] - percentileUpper) / baseUpper
+        factor = factor * scaleTerm
+        channelCpy[isUpper] = (percentileUpper * (1.0 - factor)) if (percentileUpper < 0.0) else (percentileUpper * (1.0 + factor))
 
-        # Iterate over lower outliers
-        for rowIdx in range(len(idxLower[0])):
-            
-            # For readablity save indices in local variable
-            iRow = idxLower[0][rowIdx]
-            iCol = idxLower[1][rowIdx]
-
-            # Flag indicating negative percentile
-            isNegative = (percentileLower < 0.0)
-
-            # Compute factor to scale
-            factor = (percentileLower - channelCpy[iRow, iCol]) / baseLower
-            factor *= scaleTerm
-
-            # Finally, scale outlier.
-            channelCpy[iRow, iCol] = (percentileLower * (1.0 + factor)) if isNegative else ((percentileLower * (1.0 - factor)))
+        # Scale lower outliers
+        factor = (percentileLower - channelCpy[isLower]) / baseLower
+        factor = factor * scaleTerm
+        channelCpy[isLower] = (percentileLower * (1.0 + factor)) if (percentileLower < 0.0) else (percentileLower * (1.0 - factor))
 
     return channelCpy
         
@@ -254,14 +272,14 @@ def show_range_image(frame, lidar_name):
 
         # step 2 : extract the range and the intensity channel from the range image
         # step 3 : set values < 0 to zero (is done in loadRangeImage)
-        rangeImage = loadRangeImage(lidar)
+        rangeImage = loadRangeImage(lidar, frame)
         channels = getRangeImageChannels(rangeImage)
     
         # step 4 : map the range channel onto an 8-bit scale and make sure that the full range of values is appropriately considered
         rangeUInt8 = scaleDataToUInt8(channels[RANGE])
 
         # step 5 : map the intensity channel onto an 8-bit scale and normalize with the difference between the 1- and 99-percentile to mitigate the influence of outliers
-        intensityUInt8 = handleOutliers(channels[INTENSITY], 1, 99, 0.5)
+        intensityUInt8 = handleOutliers(channels[INTENSITY], 1, 99, 0.5, inPlace=True)
         intensityUInt8 = scaleDataToUInt8(intensityUInt8)
 
         # step 6 : stack the range and intensity image vertically using np.vstack and convert the result to an unsigned 8-bit integer
@@ -272,58 +290,73 @@ def show_range_image(frame, lidar_name):
     
     return img_range_intensity
 
-def normalizeIntensityPCL(lidar_pcl, index = 3):
+def normalizeIntensityPCL(lidar_pcl, index = 3, inPlace = False, approxPercentile = False):
     # Outlier scaling term, outlier shall be only 30% higher than 90% percentile or 30 lesser then 10% percentile
     SCALE_TERM = 0.3
 
     # Save pcl in local copy as arrays are mutable. Don't wannt to call by reference
-    pcl = lidar_pcl.copy()
+    pcl = lidar_pcl if inPlace else lidar_pcl.copy()
+    values = pcl[:, index]
 
     # Outlier threshold, 90% percentile
-    thresh = np.percentile(pcl[:, index], 90)
-    idxOutliers = np.where(pcl[:, index] > thresh)
+    thresh = computePercentiles(values, [90], approxPercentile)[0]
+    isOutlier = values > thresh
 
     # Compute baseline for scaling
-    baseLine = np.max(pcl[:, index]) - thresh
+    baseLine = np.max(values) - thresh
 
-    # Iterate over upper outliers
-    for i in idxOutliers:
+    # Scale upper outliers
+    factor = (values[isOutlier] - thresh) / baseLine
+    factor *= SCALE_TERM
+    values[isOutlier] = (thresh * (1.0 - factor)) if (thresh < 0.0) else (thresh * (1.0 + factor))
+        
+    # Outlier threshold, 10% percentile
+    thresh = computePercentiles(values, [10], approxPercentile)[0]
+    isOutlier = values < thresh
+    baseLine = thresh - np.min(values)
+
+    # Scale lower outliers
+    factor = (thresh - values[isOutlier]) / baseLine
+    factor *= SCALE_TERM
+    values[isOutlier] = (thresh * (1.0 + factor)) if (thresh < 0.0) else (thresh * (1.0 - factor))
 
-        # Flag indicating negative threshold
-        isNegative = (thresh < 0.0)
+    # Now, we can normalize the data
+    values /= np.max(values)
+    return pcl
 
-        # Compute factor to scale
-        factor = (pcl[i, index] - thresh) / baseLine
-        factor *= SCALE_TERM
 
-        # Finally, scale outlier.
-        pcl[i, index] = (thresh * (1.0 - factor)) if isNegative else ((thresh * (1.0 + factor)))
-        
-    # Outlier threshold, 10% percentile
-    thresh = np.percentile(pcl[:,index], 10)
-    idxOutliers = np.where(pcl[:,index] < thresh)
-    baseLine = thresh - np.min(pcl[:,index])
+def bevCellsFromPcl(cellX, cellY, intensity, weights=None):
+    # Group the points by bev cell in a single pass with scatter reductions instead of sorting.
+    # Returns, for every occupied cell in the order of increasing (cellX, cellY):
+    # - the index of the point with the highest intensity (the first one in case of ties)
+    # - the number of points in the cell (the sum of the weights, if given)
 
-    # Iterate over upper outliers
-    for i in idxOutliers:
+    # Linear cell index. Shift by the minimum so that it also works for negative cell coordinates
+    # and the order of the linear index is the lexicographic order of (cellX, cellY)
+    offsetX = cellX.min()
+    offsetY = cellY.min()
+    numCellsY = cellY.max() - offsetY + 1
+    numCells = (cellX.max() - offsetX + 1) * numCellsY
+    linIdx = (cellX - offsetX) * numCellsY + (cellY - offsetY)
 
-        # Flag indicating negative threshold
-        isNegative = (thresh < 0.0)
+    # Number of points per cell
+    counts = np.bincount(linIdx, weights=weights, minlength=numCells)
 
-        # Compute factor to scale
-        factor = (thresh - pcl[i, index]) / baseLine
-        factor *= SCALE_TERM
+    # Highest intensity per cell
+    maxIntensity = np.full(numCells, -np.inf, dtype=np.float64)
+    np.maximum.at(maxIntensity, linIdx, intensity)
 
-        # Finally, scale outlier.
-        pcl[i, index] = (thresh * (1.0 + factor)) if isNegative else ((thresh * (1.0 - factor)))
+    # Smallest point index among the points with the highest intensity of their cell
+    idxCandidates = np.flatnonzero(intensity == maxIntensity[linIdx])
+    idxTop = np.full(numCells, len(intensity), dtype=np.int64)
+    np.minimum.at(idxTop, linIdx[idxCandidates], idxCandidates)
 
-    # Now, we can normalize the data
-    pcl[:, index] /= np.max(pcl[:, index])
-    return pcl
+    occupiedCells = np.flatnonzero(counts)
+    return idxTop[occupiedCells], counts[occupiedCells]
 
 
-# create birds-eye view of lidar data
-def bev_from_pcl(lidar_pcl, configs):
+# crop the point-cloud to the detection area and convert it into bev-map coordinates
+def bevCoordinatesFromPcl(lidar_pcl, configs):
 
     # remove lidar points outside detection area and with too low reflectivity
     mask = np.where((lidar_pcl[:, 0] >= configs.lim_x[0]) & (lidar_pcl[:, 0] <= configs.lim_x[1]) &
@@ -334,101 +367,130 @@ def bev_from_pcl(lidar_pcl, configs):
     # shift level of ground plane to avoid flipping from 0 to 255 for neighboring pixels
     lidar_pcl[:, 2] = lidar_pcl[:, 2] - configs.lim_z[0]  
 
-    # convert sensor coordinates to bev-map coordinates (center is bottom-middle)
-    ####### ID_S2_EX1 START #######     
-    #######
-    print("student task ID_S2_EX1")
-
     ## step 1 :  compute bev-map discretization by dividing x-range by the bev-image height (see configs)
     dX = (configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height
     dY = (configs.lim_y[1] - configs.lim_y[0]) / configs.bev_width
 
-    ## step 2 : create a copy of the lidar pcl and transform all matrix x-coordinates into bev-image coordinates
-    lidar_pcl_cpy = lidar_pcl.copy()
+    ## step 2 : transform all matrix x-coordinates into bev-image coordinates
+    ##          (lidar_pcl is already a copy because of the masking above)
+    lidar_pcl_cpy = lidar_pcl
     lidar_pcl_cpy[:, 0] = np.int_(np.floor(lidar_pcl_cpy[:, 0] / dX))
 
     # step 3 : perform the same operation as in step 2 for the y-coordinates but make sure that no negative bev-coordinates occur
     lidar_pcl_cpy[:, 1] = np.int_(np.floor(lidar_pcl_cpy[:, 1] / dY) + (configs.bev_width + 1) / 2)
 
+    return lidar_pcl_cpy
+
+
+# compute the intensity, height and density layers of the bev map from a point-cloud in bev-map coordinates
+# and write them into bevMap, a (3, bev_height, bev_width) float32 array which is zeroed first
+def fillBevMap(lidar_pcl_cpy, configs, bevMap):
+    bevMap.fill(0.0)
+
+    # group the points by bev cell and find the point with the highest intensity in each cell
+    # (same result as sorting by x, y, -intensity with np.lexsort, but in a single O(N) pass)
+    cellX = np.int_(lidar_pcl_cpy[:, 0])
+    cellY = np.int_(lidar_pcl_cpy[:, 1])
+    # a voxelized point-cloud (see misc/pcl_preprocessing.py) stores the number of points of each voxel
+    weights = lidar_pcl_cpy[:, VOXEL_COUNT] if configs.get('voxel_size') is not None else None
+    idxHeighestIntense, counts = bevCellsFromPcl(cellX, cellY, lidar_pcl_cpy[:, 3], weights)
+
+    # keep only the point with the highest intensity per x,y-cell, ordered by x, then y
+    lidar_pcl_top = lidar_pcl_cpy[idxHeighestIntense]
+
+    # only cells inside the bev map are written
+    cellX = np.int_(lidar_pcl_top[:, 0])
+    cellY = np.int_(lidar_pcl_top[:, 1])
+    inside = (cellX >= 0) & (cellX < configs.bev_height) & (cellY >= 0) & (cellY < configs.bev_width)
+    cellX = cellX[inside]
+    cellY = cellY[inside]
+
+    # intensity layer (b_map): normalized to mitigate the influence of outliers
+    approxPercentile = configs.get('approx_percentile', False)
+    lidar_pcl_top = normalizeIntensityPCL(lidar_pcl_top, inPlace=True, approxPercentile=approxPercentile)
+    bevMap[0, cellX, cellY] = lidar_pcl_top[inside, 3]
+
+    # height layer (g_map): height of the point with the highest intensity, normalized as the intensity
+    lidar_pcl_top = normalizeIntensityPCL(lidar_pcl_top, 2, inPlace=True, approxPercentile=approxPercentile)
+    bevMap[1, cellX, cellY] = lidar_pcl_top[inside, 2]
+
+    # density layer (r_map)
+    normalizedCounts = np.minimum(1.0, np.log(counts + 1) / np.log(64)) 
+    bevMap[2, cellX, cellY] = normalizedCounts[inside]
+
+
+# create birds-eye view of lidar data
+def bev_from_pcl(lidar_pcl, configs):
+
+    # in headless mode (batch runs) no windows are opened and nothing is printed
+    headless = configs.get('headless', False)
+
+    # convert sensor coordinates to bev-map coordinates (center is bottom-middle)
+    ####### ID_S2_EX1 START #######     
+    #######
+    if not headless:
+        print("student task ID_S2_EX1")
+
+    ## step 1 - 3 : crop the point-cloud and compute the bev-map coordinates
+    lidar_pcl_cpy = bevCoordinatesFromPcl(lidar_pcl, configs)
+
     # step 4 : visualize point-cloud using the function show_pcl from a previous task
-    show_pcl(lidar_pcl_cpy)
+    if not headless:
+        show_pcl(lidar_pcl_cpy)
     
     #######
     ####### ID_S2_EX1 END #######     
     
     
-    # Compute intensity layer of the BEV map
+    # Compute intensity, height and density layers of the BEV map
     ####### ID_S2_EX2 START #######     
+    ####### ID_S2_EX3 START #######     
     #######
-    print("student task ID_S2_EX2")
+    if not headless:
+        print("student task ID_S2_EX2")
+        print("student task ID_S2_EX3")
 
-    ## step 1 : create a numpy array filled with zeros which has the same dimensions as the BEV map
-    intensity_map = np.zeros([configs.bev_height, configs.bev_width])
+    ## step 1 : create a float32 tensor for the BEV map, the layers are written directly into it
+    bev_maps = torch.zeros((1, 3, configs.bev_height, configs.bev_width), dtype=torch.float32)
 
-    # step 2 : re-arrange elements in lidar_pcl_cpy by sorting first by x, then y, then -intensity (use numpy.lexsort)
-    #          Note lexsort tuple needs to be in REVERSED order: (thirdSort, secondSort, firstSort) -> (by -intensity, by y, by x)
-    idxSorted = np.lexsort((-lidar_pcl_cpy[:, 3], lidar_pcl_cpy[:, 1], lidar_pcl_cpy[:, 0]))
-    lidar_pcl_top = lidar_pcl_cpy[idxSorted]
+    ## step 2 : compute the intensity, height and density layers
+    fillBevMap(lidar_pcl_cpy, configs, bev_maps[0].numpy())
 
-    ## step 3 : extract all points with identical x and y such that only the top-most z-coordinate is kept (use numpy.unique)
-    ##          also, store the number of points per x,y-cell in a variable named "counts" for use in the next task
-    counts, idxHeighestIntense = np.unique(lidar_pcl_top[:, 0 : 2], axis=0, return_index=True)
-    lidar_pcl_top = lidar_pcl_top[idxHeighestIntense]
-
-    ## step 4 : assign the intensity value of each unique entry in lidar_top_pcl to the intensity map 
-    ##          make sure that the intensity is scaled in such a way that objects of interest (e.g. vehicles) are clearly visible    
-    ##          also, make sure that the influence of outliers is mitigated by normalizing intensity on the difference between the max. and min. value within the point cloud
-    lidar_pcl_top = normalizeIntensityPCL(lidar_pcl_top)
-    intensity_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 3]
-
-    ## step 5 : temporarily visualize the intensity map using OpenCV to make sure that vehicles separate well from the background
-    cv2.imshow('Intensity Image', intensity_map)
+    ## step 3 : temporarily visualize the intensity and height maps using OpenCV to make sure that vehicles separate well from the background
+    if not headless:
+        cv2.imshow('Intensity Image', bev_maps[0, 0].numpy())
+        cv2.imshow('Height Image', bev_maps[0, 1].numpy())
 
     #######
     ####### ID_S2_EX2 END ####### 
-
-
-    # Compute height layer of the BEV map
-    ####### ID_S2_EX3 START #######     
-    #######
-    print("student task ID_S2_EX3")
-
-    ## step 1 : create a numpy array filled with zeros which has the same dimensions as the BEV map
-    height_map = np.zeros([configs.bev_height, configs.bev_width])
-
-    ## step 2 : assign the height value of each unique entry in lidar_top_pcl to the height map 
-    ##          make sure that each entry is normalized on the difference between the upper and lower height defined in the config file
-    ##          use the lidar_pcl_top data structure from the previous task to access the pixels of the height_map
-    idxSorted = np.lexsort((-lidar_pcl_top[:, 2], lidar_pcl_top[:, 1], lidar_pcl_top[:, 0]))
-    lidar_pcl_top = lidar_pcl_top[idxSorted]
-    _, idxHeighestIntense = np.unique(lidar_pcl_top[:, 0 : 2], axis=0, return_index=True)
-    lidar_pcl_top = normalizeIntensityPCL(lidar_pcl_top[idxHeighestIntense], 2)
-    height_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 2]
-
-    ## step 3 : temporarily visualize the intensity map using OpenCV to make sure that vehicles separate well from the background
-    cv2.imshow('Height Image', height_map)
-    #######
     ####### ID_S2_EX3 END #######       
 
-    # Compute density layer of the BEV map
-    density_map = np.zeros((configs.bev_height + 1, configs.bev_width + 1))
-    _, _, counts = np.unique(lidar_pcl_cpy[:, 0:2], axis=0, return_index=True, return_counts=True)
-    normalizedCounts = np.minimum(1.0, np.log(counts + 1) / np.log(64)) 
-    density_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = normalizedCounts
-        
-    # assemble 3-channel bev-map from individual maps
-    bev_map = np.zeros((3, configs.bev_height, configs.bev_width))
-    bev_map[2, :, :] = density_map[:configs.bev_height, :configs.bev_width]  # r_map
-    bev_map[1, :, :] = height_map[:configs.bev_height, :configs.bev_width]  # g_map
-    bev_map[0, :, :] = intensity_map[:configs.bev_height, :configs.bev_width]  # b_map
-
-    # expand dimension of bev_map before converting into a tensor
-    s1, s2, s3 = bev_map.shape
-    bev_maps = np.zeros((1, s1, s2, s3))
-    bev_maps[0] = bev_map
-
-    bev_maps = torch.from_numpy(bev_maps)  # create tensor from birds-eye view
-    input_bev_maps = bev_maps.to(configs.device, non_blocking=True).float()
+    input_bev_maps = bev_maps.to(configs.device, non_blocking=True)
     return input_bev_maps
 
 
+# create birds-eye views of lidar data into preallocated buffers
+class BevBuilder:
+    '''Compute birds-eye views like bev_from_pcl, but without visualization and into buffers which are
+    allocated once and reused for every frame: a float32 (1, 3, bev_height, bev_width) tensor, optionally in
+    pinned memory for faster transfers to the GPU, and a tensor of the same shape on configs.device.
+
+    The tensor returned by build() is overwritten by the next call, clone it to keep it.
+    '''
+
+    def __init__(self, configs, pinMemory=False):
+        self.configs = configs
+        pinMemory = pinMemory and torch.cuda.is_available()
+        self.bevMaps = torch.zeros((1, 3, configs.bev_height, configs.bev_width), dtype=torch.float32, pin_memory=pinMemory)
+        self.bevMap = self.bevMaps[0].numpy() # numpy view on the buffer, the layers are written through it
+        if torch.device(configs.device).type == 'cpu':
+            self.deviceBevMaps = self.bevMaps
+        else:
+            self.deviceBevMaps = torch.zeros_like(self.bevMaps, device=configs.device)
+
+    def build(self, lidar_pcl):
+        lidar_pcl_cpy = bevCoordinatesFromPcl(lidar_pcl, self.configs)
+        fillBevMap(lidar_pcl_cpy, self.configs, self.bevMap)
+        if self.deviceBevMaps is not self.bevMaps:
+            self.deviceBevMaps.copy_(self.bevMaps, non_blocking=True)
+        return self.deviceBevMaps
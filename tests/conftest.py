@@ -0,0 +1,102 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Shared fixtures of the tests, synthetic frames and tfrecord files
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import struct
+import zlib
+import numpy as np
+import pytest
+from easydict import EasyDict as edict
+
+# add project directory to python path to enable relative imports
+import os
+import sys
+PACKAGE_PARENT = '..'
+SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
+sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
+
+from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+from tools.waymo_reader.simple_waymo_open_dataset_reader.checksum import masked_crc32c
+
+
+## Returns a frame with calibrations, compressed range images of all lasers, camera images and labels
+def make_frame(frame_id, rng, height=16, width=40):
+    frame = dataset_pb2.Frame()
+    frame.context.name = 'synthetic-segment'
+    frame.timestamp_micros = 1000000 + frame_id * 100000
+    pose = np.eye(4)
+    pose[0, 3] = frame_id
+    frame.pose.transform.extend(pose.ravel().tolist())
+
+    for laser_name in [dataset_pb2.LaserName.TOP, dataset_pb2.LaserName.FRONT]:
+        calibration = frame.context.laser_calibrations.add()
+        calibration.name = laser_name
+        calibration.extrinsic.transform.extend(np.eye(4).ravel().tolist())
+        calibration.beam_inclinations.extend(np.linspace(-0.3, 0.04, height).tolist())
+
+        laser = frame.lasers.add()
+        laser.name = laser_name
+        for laser_return in (laser.ri_return1, laser.ri_return2):
+            range_image = dataset_pb2.MatrixFloat()
+            range_image.data.extend(rng.uniform(-1, 60, height * width * 4).astype(np.float32).tolist())
+            range_image.shape.dims.extend([height, width, 4])
+            laser_return.range_image_compressed = zlib.compress(range_image.SerializeToString())
+            projection = dataset_pb2.MatrixInt32()
+            projection.data.extend(rng.integers(-2000, 2000, height * width * 6).tolist())
+            projection.shape.dims.extend([height, width, 6])
+            laser_return.camera_projection_compressed = zlib.compress(projection.SerializeToString())
+
+    image = frame.images.add()
+    image.name = dataset_pb2.CameraName.FRONT
+    image.image = rng.bytes(1000)
+
+    for label_id in range(2 + frame_id % 3):
+        label = frame.laser_labels.add()
+        label.type = 1
+        label.id = 'label-{}'.format(label_id)
+        label.box.center_x = 10.0 + 5 * label_id
+        label.box.length = 4.0
+        label.box.width = 2.0
+        label.box.height = 1.5
+    return frame
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    return [make_frame(frame_id, rng) for frame_id in range(4)]
+
+
+@pytest.fixture
+def tfrecord(tmp_path, frames):
+    filename = str(tmp_path / 'segment.tfrecord')
+    with open(filename, 'wb') as f:
+        for frame in frames:
+            data = frame.SerializeToString()
+            header = struct.pack('Q', len(data))
+            f.write(header + struct.pack('I', masked_crc32c(header)) + data + struct.pack('I', masked_crc32c(data)))
+    return filename
+
+
+## Returns a point-cloud with points outside of the detection area and many intensity ties
+def random_pcl(rng, num_points=20000):
+    lidar_pcl = np.column_stack([rng.uniform(-5, 55, num_points), rng.uniform(-30, 30, num_points),
+                                 rng.uniform(-2, 4, num_points), np.round(rng.uniform(0, 1.2, num_points), 1)])
+    lidar_pcl[:10, 0] = 0.0   # on the border of the detection area
+    lidar_pcl[10:20, 1] = -25.0
+    return lidar_pcl
+
+
+@pytest.fixture
+def configs():
+    # small birds-eye view, no visualization
+    return edict(lim_x=[0, 50], lim_y=[-25, 25], lim_z=[-1, 3], bev_height=64, bev_width=64, device='cpu', headless=True)
@@ -0,0 +1,87 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Compare the birds-eye view with the sort-based reference implementation
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import numpy as np
+import pytest
+import torch
+
+import student.objdet_pcl as pcl
+from conftest import random_pcl
+
+
+## Birds-eye view as computed by lexsort and np.unique (the original implementation of bev_from_pcl)
+def reference_bev(lidar_pcl, configs):
+    mask = np.where((lidar_pcl[:, 0] >= configs.lim_x[0]) & (lidar_pcl[:, 0] <= configs.lim_x[1]) &
+                    (lidar_pcl[:, 1] >= configs.lim_y[0]) & (lidar_pcl[:, 1] <= configs.lim_y[1]) &
+                    (lidar_pcl[:, 2] >= configs.lim_z[0]) & (lidar_pcl[:, 2] <= configs.lim_z[1]))
+    lidar_pcl = lidar_pcl[mask]
+    lidar_pcl[:, 2] = lidar_pcl[:, 2] - configs.lim_z[0]
+
+    dX = (configs.lim_x[1] - configs.lim_x[0]) / configs.bev_height
+    dY = (configs.lim_y[1] - configs.lim_y[0]) / configs.bev_width
+    lidar_pcl_cpy = lidar_pcl.copy()
+    lidar_pcl_cpy[:, 0] = np.int_(np.floor(lidar_pcl_cpy[:, 0] / dX))
+    lidar_pcl_cpy[:, 1] = np.int_(np.floor(lidar_pcl_cpy[:, 1] / dY) + (configs.bev_width + 1) / 2)
+
+    intensity_map = np.zeros([configs.bev_height + 1, configs.bev_width + 1])
+    idxSorted = np.lexsort((-lidar_pcl_cpy[:, 3], lidar_pcl_cpy[:, 1], lidar_pcl_cpy[:, 0]))
+    lidar_pcl_top = lidar_pcl_cpy[idxSorted]
+    _, idxHeighestIntense, counts = np.unique(lidar_pcl_top[:, 0:2], axis=0, return_index=True, return_counts=True)
+    lidar_pcl_top = pcl.normalizeIntensityPCL(lidar_pcl_top[idxHeighestIntense])
+    intensity_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 3]
+
+    height_map = np.zeros([configs.bev_height + 1, configs.bev_width + 1])
+    lidar_pcl_top = pcl.normalizeIntensityPCL(lidar_pcl_top, 2)
+    height_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = lidar_pcl_top[:, 2]
+
+    density_map = np.zeros([configs.bev_height + 1, configs.bev_width + 1])
+    density_map[np.int_(lidar_pcl_top[:, 0]), np.int_(lidar_pcl_top[:, 1])] = np.minimum(1.0, np.log(counts + 1) / np.log(64))
+
+    bev_map = np.stack([intensity_map, height_map, density_map])[:, :configs.bev_height, :configs.bev_width]
+    return torch.from_numpy(bev_map[np.newaxis]).float()
+
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_bev_from_pcl_matches_reference(configs, dtype):
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        lidar_pcl = random_pcl(rng).astype(dtype)
+        original = lidar_pcl.copy()
+        bev = pcl.bev_from_pcl(lidar_pcl, configs)
+        assert bev.dtype == torch.float32 and bev.shape == (1, 3, configs.bev_height, configs.bev_width)
+        assert torch.equal(bev, reference_bev(lidar_pcl, configs))
+        np.testing.assert_array_equal(lidar_pcl, original)
+
+
+def test_bev_builder_matches_bev_from_pcl(configs):
+    rng = np.random.default_rng(1)
+    bev_builder = pcl.BevBuilder(configs)
+    for _ in range(3):
+        lidar_pcl = random_pcl(rng)
+        # the buffer of the builder is reused, every frame is written from scratch
+        assert torch.equal(bev_builder.build(lidar_pcl), pcl.bev_from_pcl(lidar_pcl, configs))
+
+
+def test_bev_cells_from_pcl():
+    rng = np.random.default_rng(2)
+    cellX = rng.integers(-3, 5, 1000)
+    cellY = rng.integers(-2, 4, 1000)
+    intensity = np.round(rng.uniform(0, 1, 1000), 1)
+    idxTop, counts = pcl.bevCellsFromPcl(cellX, cellY, intensity)
+
+    cells, inverse, expectedCounts = np.unique(np.column_stack([cellX, cellY]), axis=0, return_inverse=True, return_counts=True)
+    np.testing.assert_array_equal(counts, expectedCounts)
+    for cell, idx in enumerate(idxTop):
+        inCell = np.flatnonzero(inverse.ravel() == cell)
+        # first point with the highest intensity of the cell
+        assert idx == inCell[np.argmax(intensity[inCell])]
@@ -0,0 +1,38 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Compare the numpy CRC32C fallback with a native implementation
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import os
+import pytest
+
+from tools.waymo_reader.simple_waymo_open_dataset_reader import checksum
+
+
+def test_check_value():
+    # CRC32C of the ASCII digits 1 to 9 (RFC 3720)
+    assert checksum._crc32c_numpy(b'123456789') == 0xe3069283
+
+
+@pytest.mark.parametrize('length', [0, 1, 7, checksum.CHUNK_SIZE - 1, checksum.CHUNK_SIZE, checksum.CHUNK_SIZE + 1, 5 * checksum.CHUNK_SIZE + 123])
+def test_fallback_matches_native(length):
+    crc32c = pytest.importorskip('crc32c')
+    data = os.urandom(length)
+    assert checksum._crc32c_numpy(data) == crc32c.crc32c(data)
+    assert checksum._crc32c_numpy(memoryview(data)) == crc32c.crc32c(data)
+
+
+def test_masked_crc_without_native_implementation(monkeypatch):
+    data = os.urandom(3000)
+    expected = checksum.masked_crc32c(data)
+    monkeypatch.setattr(checksum, '_native_crc32c', None)
+    assert not checksum.has_native_crc32c()
+    assert checksum.masked_crc32c(data) == expected
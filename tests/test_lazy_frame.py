@@ -0,0 +1,85 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Compare the lazy frame view with the protobuf parser
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import pickle
+import numpy as np
+import pytest
+
+from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, dataset_pb2
+from tools.waymo_reader.simple_waymo_open_dataset_reader.lazy_frame import LazyFrame, scan_fields, _decode_repeated_scalar
+
+
+## Decodes the repeated scalar field 'data' of a serialized message with the lazy decoder
+def lazy_data(message):
+    buffer = message.SerializeToString()
+    field = type(message).DESCRIPTOR.fields_by_name['data']
+    return [item for wire_type, value in scan_fields(buffer).get(field.number, [])
+            for item in _decode_repeated_scalar(field, buffer, wire_type, value)]
+
+
+def test_fields_match_protobuf(frames):
+    for frame in frames:
+        lazy = LazyFrame(memoryview(frame.SerializeToString()))
+        for field in dataset_pb2.Frame.DESCRIPTOR.fields:
+            value = getattr(lazy, field.name)
+            if field.label == field.LABEL_REPEATED:
+                assert list(value) == list(getattr(frame, field.name)), field.name
+            else:
+                assert value == getattr(frame, field.name), field.name
+            assert lazy.HasField(field.name) == (field.number in scan_fields(frame.SerializeToString())), field.name
+        assert lazy.to_frame() == frame
+
+
+def test_find_by_name_and_slices(frames):
+    lazy = LazyFrame(frames[0].SerializeToString())
+    assert lazy.lasers.find_by_name(dataset_pb2.LaserName.FRONT) == frames[0].lasers[1]
+    assert lazy.lasers.find_by_name(dataset_pb2.LaserName.REAR) is None
+    assert lazy.laser_labels[1:] == list(frames[0].laser_labels[1:])
+
+
+def test_singular_message_fields_are_merged(frames):
+    # like protobuf, a repeated occurrence of a singular message field is merged into the first one
+    update = dataset_pb2.Frame()
+    update.context.stats.time_of_day = 'Night'
+    buffer = frames[0].SerializeToString() + update.SerializeToString()
+    expected = dataset_pb2.Frame()
+    expected.ParseFromString(buffer)
+    assert LazyFrame(buffer).context == expected.context
+
+
+def test_packed_repeated_scalars_decode_every_element():
+    rng = np.random.default_rng(0)
+    floats = dataset_pb2.MatrixFloat()
+    floats.data.extend(rng.normal(size=100).astype(np.float32).tolist())
+    ints = dataset_pb2.MatrixInt32()
+    ints.data.extend(rng.integers(-2**31, 2**31, 100).tolist())
+    assert lazy_data(floats) == list(floats.data)
+    assert lazy_data(ints) == list(ints.data)
+
+    # a field split into several packed runs is decoded in order
+    split = dataset_pb2.MatrixInt32()
+    split.ParseFromString(ints.SerializeToString() + ints.SerializeToString())
+    assert lazy_data(split) == list(ints.data) * 2
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_reader_lazy_frames(tfrecord, frames, use_mmap):
+    with WaymoDataFileReader(tfrecord, use_mmap=use_mmap, lazy=True, verify_crc=True) as reader:
+        assert len(reader) == len(frames)
+        for frame_id, frame in enumerate(frames):
+            lazy = reader.read_frame(frame_id)
+            assert isinstance(lazy, LazyFrame)
+            assert lazy.laser_labels[-1] == frame.laser_labels[-1]
+            assert lazy.to_frame() == frame
+            assert pickle.loads(pickle.dumps(lazy)).to_frame() == frame
+            del lazy
@@ -0,0 +1,64 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Compare the wire format matrix decoders with the protobuf parser
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import numpy as np
+
+from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2
+from tools.waymo_reader.simple_waymo_open_dataset_reader.matrix import decode_matrix_float, decode_matrix_int32, decode_varints
+
+
+## Decodes a serialized matrix with the protobuf parser
+def parse_matrix(matrix_class, buffer, dtype):
+    matrix = matrix_class()
+    matrix.ParseFromString(buffer)
+    return np.array(matrix.data, dtype=dtype).reshape(matrix.shape.dims)
+
+
+def test_decode_matrix_float():
+    rng = np.random.default_rng(0)
+    matrix = dataset_pb2.MatrixFloat()
+    matrix.data.extend(rng.normal(size=(8, 10, 4)).astype(np.float32).ravel().tolist())
+    matrix.shape.dims.extend([8, 10, 4])
+    buffer = matrix.SerializeToString()
+    np.testing.assert_array_equal(decode_matrix_float(buffer), parse_matrix(dataset_pb2.MatrixFloat, buffer, np.float32))
+
+    # data in several packed runs (merged messages), decoded from a memoryview
+    head = dataset_pb2.MatrixFloat()
+    head.data.extend(matrix.data[:100])
+    tail = dataset_pb2.MatrixFloat()
+    tail.data.extend(matrix.data[100:])
+    tail.shape.CopyFrom(matrix.shape)
+    buffer = head.SerializeToString() + tail.SerializeToString()
+    np.testing.assert_array_equal(decode_matrix_float(memoryview(buffer)), parse_matrix(dataset_pb2.MatrixFloat, buffer, np.float32))
+
+
+def test_decode_matrix_int32():
+    rng = np.random.default_rng(0)
+    matrix = dataset_pb2.MatrixInt32()
+    matrix.data.extend(rng.integers(-2**31, 2**31, 30 * 6).tolist() + [0, -1, 2**31 - 1, -2**31, 127, 128])
+    matrix.shape.dims.extend([31, 6])
+    buffer = matrix.SerializeToString()
+    decoded = decode_matrix_int32(buffer)
+    assert decoded.dtype == np.int32
+    np.testing.assert_array_equal(decoded, parse_matrix(dataset_pb2.MatrixInt32, buffer, np.int32))
+
+
+
+def test_decode_varints():
+    values = np.array([0, 1, 127, 128, 300, 2**31 - 1, -1, -2**31], dtype=np.int64)
+    matrix = dataset_pb2.MatrixInt32()
+    matrix.data.extend(values.tolist())
+    buffer = matrix.SerializeToString()
+    # payload of the packed data field: tag and length (1 byte each) precede it
+    np.testing.assert_array_equal(decode_varints(np.frombuffer(buffer[2:], dtype=np.uint8)), values)
+    assert decode_varints(np.zeros(0, dtype=np.uint8)).shape == (0,)
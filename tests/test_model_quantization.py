@@ -0,0 +1,57 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Check the collection of the calibration birds-eye views of the quantization
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import os
+import pickle
+import torch
+
+from misc.frame_store import FrameStore, store_filename
+from misc.model_quantization import calibration_bevs
+from misc.stage_cache import CACHE_SUFFIX, StageCache
+
+SEQUENCE = 'segment.tfrecord'
+
+
+## Returns the names, sizes and modification times of all files in a directory
+def snapshot(path):
+    return {filename: os.stat(os.path.join(path, filename))[6:9] for filename in os.listdir(path)}
+
+
+def test_calibration_bevs_are_read_only(tmp_path, configs):
+    path = str(tmp_path)
+    bev = lambda frame_id: torch.full((1, 3, configs.bev_height, configs.bev_width), float(frame_id))
+
+    # frames 0 - 3 in the result store, 4 - 7 as binary files (frame 10 of another size),
+    # frame 8 in the stage cache for the current configs (frame 3 again), frame 9 for other configs
+    with FrameStore(store_filename(path, SEQUENCE)) as store:
+        for frame_id in range(4):
+            store.append('lidar_bev', frame_id, bev(frame_id))
+    for frame_id in range(4, 8):
+        with open(os.path.join(path, 'segment__frame-{}__lidar_bev.pkl'.format(frame_id)), 'wb') as f:
+            pickle.dump(bev(frame_id), f)
+    with open(os.path.join(path, 'segment__frame-10__lidar_bev.pkl'), 'wb') as f:
+        pickle.dump(torch.zeros((1, 3, 8, 8)), f)
+    cache = StageCache(path, SEQUENCE, configs)
+    for frame_id in [3, 8]:
+        cache.get_or_compute('lidar_bev', frame_id, lambda: bev(frame_id))
+    cache.close()
+    with FrameStore(os.path.join(path, 'segment' + CACHE_SUFFIX)) as cache:
+        cache.append('lidar_bev-0123', 9, bev(9))
+
+    files = snapshot(path)
+    bevs = calibration_bevs(path, SEQUENCE, configs, 10)
+    assert [int(b[0, 0, 0, 0]) for b in bevs] == list(range(9))
+    assert snapshot(path) == files
+
+    # num_frames views, evenly spaced over the frames with a valid birds-eye view
+    assert [int(b[0, 0, 0, 0]) for b in calibration_bevs(path, SEQUENCE, configs, 3)] == [0, 4, 8]
@@ -0,0 +1,60 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Check that the point-cloud preprocessing preserves the birds-eye view
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import numpy as np
+import pytest
+import torch
+from easydict import EasyDict as edict
+
+import student.objdet_pcl as pcl
+from misc.pcl_preprocessing import crop_to_roi, preprocess_pcl, voxel_grid, VOXEL_COUNT, VOXEL_MAX_HEIGHT
+from conftest import random_pcl
+
+
+@pytest.mark.parametrize('pcl_crop', [False, True])
+def test_bev_pillars_preserve_the_bev(configs, pcl_crop):
+    rng = np.random.default_rng(0)
+    configs_voxel = edict(configs)
+    configs_voxel.update(pcl_crop=pcl_crop, voxel_size='bev')
+    for _ in range(3):
+        lidar_pcl = random_pcl(rng)
+        voxelized = preprocess_pcl(lidar_pcl, configs_voxel)
+        assert len(voxelized) <= configs.bev_height * configs.bev_width
+        assert torch.equal(pcl.bev_from_pcl(voxelized, configs_voxel), pcl.bev_from_pcl(crop_to_roi(lidar_pcl, configs), configs))
+
+
+def test_voxel_grid_matches_unique(configs):
+    rng = np.random.default_rng(1)
+    lidar_pcl = random_pcl(rng)
+    voxelized = voxel_grid(lidar_pcl, 0.5)
+
+    keys = np.floor(lidar_pcl[:, :3] / 0.5).astype(np.int64)
+    voxels, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    assert len(voxelized) == len(voxels)
+
+    # one row per voxel, in the original point order, with the first point of highest intensity
+    expected = []
+    for voxel in range(len(voxels)):
+        inVoxel = np.flatnonzero(inverse == voxel)
+        expected.append(inVoxel[np.argmax(lidar_pcl[inVoxel, 3])])
+    order = np.sort(expected)
+    np.testing.assert_array_equal(voxelized[:, :4], lidar_pcl[order])
+    np.testing.assert_array_equal(voxelized[:, VOXEL_COUNT], counts[inverse[order]])
+    maxHeights = np.array([lidar_pcl[inverse == inverse[idx], 2].max() for idx in order])
+    np.testing.assert_array_equal(voxelized[:, VOXEL_MAX_HEIGHT], maxHeights)
+
+
+def test_no_preprocessing_returns_the_point_cloud(configs):
+    lidar_pcl = random_pcl(np.random.default_rng(2))
+    assert preprocess_pcl(lidar_pcl, configs) is lidar_pcl
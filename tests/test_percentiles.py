@@ -0,0 +1,53 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Bound the error of the histogram-based percentiles against np.percentile
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import numpy as np
+import pytest
+
+import student.objdet_pcl as pcl
+
+PERCENTILES = [0, 1, 10, 50, 90, 99, 100]
+
+
+def test_small_arrays_are_exact():
+    rng = np.random.default_rng(0)
+    data = rng.standard_t(2, size=(20, 20)) * 5
+    np.testing.assert_allclose(pcl.approxPercentiles(data, PERCENTILES), np.percentile(data, PERCENTILES))
+
+
+@pytest.mark.parametrize('distribution', ['uniform', 'heavy_tails', 'ties'])
+def test_error_is_bounded(distribution):
+    rng = np.random.default_rng(1)
+    numBins = 1024
+    size = pcl.MIN_VALUES_PER_BIN * numBins * 4
+    if distribution == 'uniform':
+        data = rng.uniform(0, 1, size)
+    elif distribution == 'heavy_tails':
+        data = rng.standard_t(1, size)
+    else:
+        data = np.round(rng.normal(size=size), 1)
+
+    approx = pcl.approxPercentiles(data, PERCENTILES, numBins)
+    exact = np.percentile(data, PERCENTILES)
+
+    # at most one bin width plus the gap between the sorted values around the rank of each percentile
+    sortedData = np.sort(data)
+    ranks = np.asarray(PERCENTILES) / 100.0 * (size - 1)
+    gaps = sortedData[np.ceil(ranks).astype(int)] - sortedData[np.floor(ranks).astype(int)]
+    binWidth = (data.max() - data.min()) / numBins
+    assert np.all(np.abs(approx - exact) <= binWidth + gaps + 1e-12)
+
+
+def test_constant_data():
+    data = np.full(pcl.MIN_VALUES_PER_BIN * 1024, 0.5, dtype=np.float32)
+    assert np.all(pcl.approxPercentiles(data, PERCENTILES) == 0.5)
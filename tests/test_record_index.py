@@ -0,0 +1,34 @@
+# ---------------------------------------------------------------------
+# Project "Track 3D-Objects Over Time"
+# Copyright (C) 2020, Dr. Antje Muntzinger / Dr. Andreas Haja.
+#
+# Purpose of this file : Check the record table and the persistent frame index of the reader
+#
+# You should have received a copy of the Udacity license together with this program.
+#
+# https://www.udacity.com/course/self-driving-car-engineer-nanodegree--nd013
+# ----------------------------------------------------------------------
+#
+
+# imports
+import os
+
+from tools.waymo_reader.simple_waymo_open_dataset_reader import WaymoDataFileReader, record_index
+
+
+def test_record_table_uses_the_saved_index(tfrecord, frames, monkeypatch):
+    with WaymoDataFileReader(tfrecord, use_index=False) as reader:
+        scanned = reader.get_record_table()
+    assert len(scanned) == len(frames)
+
+    with WaymoDataFileReader(tfrecord) as reader:
+        assert reader.get_record_table() == scanned
+    assert os.path.isfile(record_index.index_filename(tfrecord))
+
+    # a new reader loads the offsets from the sidecar instead of reading the file
+    def fail(reader):
+        raise AssertionError('the index is rebuilt')
+    monkeypatch.setattr(record_index, 'build_index', fail)
+    with WaymoDataFileReader(tfrecord) as reader:
+        assert reader.get_record_table() == scanned
+        assert reader.read_frame(len(frames) - 1) == frames[-1]
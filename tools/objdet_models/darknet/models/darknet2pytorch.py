@@ -74,11 +74,12 @@ class Upsample_expand(nn.Module):
 
     def forward(self, x):
         stride = self.stride
-        assert (x.data.dim() == 4)
-        B = x.data.size(0)
-        C = x.data.size(1)
-        H = x.data.size(2)
-        W = x.data.size(3)
+        assert (x.dim() == 4)
+        # shape of x itself (not x.data), so traced graphs keep the batch size dynamic
+        B = x.size(0)
+        C = x.size(1)
+        H = x.size(2)
+        W = x.size(3)
         ws = stride
         hs = stride
         x = x.view(B, C, H, 1, W, 1).expand(B, C, H, stride, W, stride).contiguous().view(B, C, H * stride, W * stride)
@@ -158,6 +159,7 @@ class Darknet(nn.Module):
         self.height = int(self.blocks[0]['height'])
 
         self.models = self.create_network(self.blocks)  # merge conv, bn,leaky
+        self.layers, self.kept_outputs = self.compile_layers(self.blocks)
         self.yolo_layers = [layer for layer in self.models if layer.__class__.__name__ == 'YoloLayer']
 
         self.loss = self.models[len(self.models) - 1]
@@ -168,73 +170,75 @@ class Darknet(nn.Module):
     def forward(self, x, targets=None):
         # batch_size, c, h, w
         img_size = x.size(2)
-        ind = -2
         self.loss = None
         outputs = dict()
         loss = 0.
         yolo_outputs = []
-        for block in self.blocks:
-            ind = ind + 1
-            # if ind > 0:
-            #    return x
-
-            if block['type'] == 'net':
-                continue
-            elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
+        # the blocks are parsed once by compile_layers, only the outputs read by later layers are kept
+        for ind, layer_type, args in self.layers:
+            if layer_type == 'module':
                 x = self.models[ind](x)
-                outputs[ind] = x
-            elif block['type'] == 'route':
-                layers = block['layers'].split(',')
-                layers = [int(i) if int(i) > 0 else int(i) + ind for i in layers]
-                if len(layers) == 1:
-                    if 'groups' not in block.keys() or int(block['groups']) == 1:
-                        x = outputs[layers[0]]
-                        outputs[ind] = x
-                    else:
-                        groups = int(block['groups'])
-                        group_id = int(block['group_id'])
-                        _, b, _, _ = outputs[layers[0]].shape
-                        x = outputs[layers[0]][:, b // groups * group_id:b // groups * (group_id + 1)]
-                        outputs[ind] = x
-                elif len(layers) == 2:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x = torch.cat((x1, x2), 1)
-                    outputs[ind] = x
-                elif len(layers) == 4:
-                    x1 = outputs[layers[0]]
-                    x2 = outputs[layers[1]]
-                    x3 = outputs[layers[2]]
-                    x4 = outputs[layers[3]]
-                    x = torch.cat((x1, x2, x3, x4), 1)
-                    outputs[ind] = x
+            elif layer_type == 'route':
+                if len(args) == 1:
+                    x = outputs[args[0]]
                 else:
-                    print("rounte number > 2 ,is {}".format(len(layers)))
-
-            elif block['type'] == 'shortcut':
-                from_layer = int(block['from'])
-                activation = block['activation']
-                from_layer = from_layer if from_layer > 0 else from_layer + ind
-                x1 = outputs[from_layer]
-                x2 = outputs[ind - 1]
-                x = x1 + x2
+                    x = torch.cat([outputs[i] for i in args], 1)
+            elif layer_type == 'route_group':
+                from_layer, groups, group_id = args
+                _, b, _, _ = outputs[from_layer].shape
+                x = outputs[from_layer][:, b // groups * group_id:b // groups * (group_id + 1)]
+            elif layer_type == 'shortcut':
+                from_layer, activation = args
+                x = outputs[from_layer] + outputs[ind - 1]
                 if activation == 'leaky':
                     x = F.leaky_relu(x, 0.1, inplace=True)
                 elif activation == 'relu':
                     x = F.relu(x, inplace=True)
-                outputs[ind] = x
-            elif block['type'] == 'yolo':
+            elif layer_type == 'yolo':
                 x, layer_loss = self.models[ind](x, targets, img_size, self.use_giou_loss)
                 loss += layer_loss
                 yolo_outputs.append(x)
-            elif block['type'] == 'cost':
                 continue
-            else:
-                print('unknown type %s' % (block['type']))
+            if ind in self.kept_outputs:
+                outputs[ind] = x
         yolo_outputs = to_cpu(torch.cat(yolo_outputs, 1))
 
         return yolo_outputs if targets is None else (loss, yolo_outputs)
 
+    def compile_layers(self, blocks):
+        """ Parse the blocks into a list of (layer index, layer type, arguments) which forward executes,
+        and return it together with the set of layers whose outputs are read by later layers.
+        """
+        layers = []
+        kept_outputs = set()
+        ind = -2
+        for block in blocks:
+            ind = ind + 1
+            if block['type'] == 'net' or block['type'] == 'cost':
+                continue
+            elif block['type'] in ['convolutional', 'maxpool', 'reorg', 'upsample', 'avgpool', 'softmax', 'connected']:
+                layers.append((ind, 'module', None))
+            elif block['type'] == 'route':
+                sources = [int(i) if int(i) > 0 else int(i) + ind for i in block['layers'].split(',')]
+                if len(sources) == 1 and 'groups' in block.keys() and int(block['groups']) != 1:
+                    layers.append((ind, 'route_group', (sources[0], int(block['groups']), int(block['group_id']))))
+                elif len(sources) in [1, 2, 4]:
+                    layers.append((ind, 'route', tuple(sources)))
+                else:
+                    # forward would have no output for this layer
+                    raise ValueError("Unsupported route of {} layers in block {}".format(len(sources), ind))
+                kept_outputs.update(sources)
+            elif block['type'] == 'shortcut':
+                from_layer = int(block['from'])
+                from_layer = from_layer if from_layer > 0 else from_layer + ind
+                layers.append((ind, 'shortcut', (from_layer, block['activation'])))
+                kept_outputs.update([from_layer, ind - 1])
+            elif block['type'] == 'yolo':
+                layers.append((ind, 'yolo', None))
+            else:
+                print('unknown type %s' % (block['type']))
+        return layers, kept_outputs
+
     def print_network(self):
         print_cfg(self.blocks)
 
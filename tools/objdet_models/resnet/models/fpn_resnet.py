@@ -163,6 +163,11 @@ class PoseResNet(nn.Module):
     def forward(self, x):
         _, _, input_h, input_w = x.size()
         hm_h, hm_w = input_h // 4, input_w // 4
+        return self.merge_fpn_outputs(self.forward_fpn(x), hm_h, hm_w)
+
+    def forward_fpn(self, x):
+        """Backbone, feature pyramid and heads without shape-dependent control flow (symbolically traceable):
+        returns the outputs of each head at the three pyramid levels"""
         x = self.conv1(x)
         x = self.bn1(x)
         x = self.relu(x)
@@ -190,24 +195,34 @@ class PoseResNet(nn.Module):
         # up_level4: torch.Size([b, 64, 56, 56])
         up_level4 = self.conv_up_level3(torch.cat((up_level3, out_layer1), dim=1))
 
-        ret = {}
+        fpn_outs = {}
         for head in self.heads:
+            fpn_outs[head] = [self.__getattr__('fpn{}_{}'.format(fpn_idx, head))(fdn_input)
+                              for fpn_idx, fdn_input in enumerate([up_level2, up_level3, up_level4])]
+
+        return fpn_outs
+
+    @staticmethod
+    def merge_fpn_outputs(fpn_outs, hm_h, hm_w):
+        """Merge the pyramid levels of each head into an output of heatmap size"""
+        ret = {}
+        for head in fpn_outs:
             temp_outs = []
-            for fpn_idx, fdn_input in enumerate([up_level2, up_level3, up_level4]):
-                fpn_out = self.__getattr__('fpn{}_{}'.format(fpn_idx, head))(fdn_input)
+            for fpn_out in fpn_outs[head]:
                 _, _, fpn_out_h, fpn_out_w = fpn_out.size()
                 # Make sure the added features having same size of heatmap output
                 if (fpn_out_w != hm_w) or (fpn_out_h != hm_h):
                     fpn_out = F.interpolate(fpn_out, size=(hm_h, hm_w))
                 temp_outs.append(fpn_out)
             # Take the softmax in the keypoint feature pyramid network
-            final_out = self.apply_kfpn(temp_outs)
+            final_out = PoseResNet.apply_kfpn(temp_outs)
 
             ret[head] = final_out
 
         return ret
 
-    def apply_kfpn(self, outs):
+    @staticmethod
+    def apply_kfpn(outs):
         outs = torch.cat([out.unsqueeze(-1) for out in outs], dim=-1)
         softmax_outs = F.softmax(outs, dim=-1)
         ret_outs = (outs * softmax_outs).sum(dim=-1)
@@ -13,20 +13,105 @@
 # limitations under the License.
 # ==============================================================================
 
+import mmap
+import os
 import struct
 from . import dataset_pb2
+from . import record_index
+from .checksum import masked_crc32c
+from .lazy_frame import LazyFrame
+
+class CorruptRecordError(IOError):
+    """ Raised when a record of a tfrecord file is truncated or fails its CRC check. """
+
+    def __init__(self, path, offset, reason):
+        super(CorruptRecordError, self).__init__("{} at offset {} in {}".format(reason, offset, path))
+        self.path = path
+        self.offset = offset
+        self.reason = reason
 
 class WaymoDataFileReader:
-    def __init__(self, filename):
+    def __init__(self, filename, use_index=True, use_mmap=False, lazy=False, verify_crc=False):
+        """ Open a tfrecord file of the Waymo Open Dataset.
+
+        use_index: If set, the frame index is loaded from (or written to) a sidecar file next to
+                   the tfrecord file. This makes random access to frames cheap on subsequent runs.
+        use_mmap: If set, the file is memory-mapped and records are handed to the protobuf parser
+                  as memoryview slices of the mapping, without copying them into a bytes object first.
+                  Several readers (also in different processes) share the OS page cache of the file.
+        lazy: If set, records are returned as LazyFrame views which only decode the fields that are
+              accessed instead of fully parsed dataset_pb2.Frame messages.
+        verify_crc: If set, the masked CRC32C checksums of the length header and of the payload of each
+                    record are checked and a CorruptRecordError is raised on mismatch.
+        """
+
+        self.filename = filename
         self.file = open(filename, "rb")
+        self.use_index = use_index
+        self.index = None
+        self.lazy = lazy
+        self.verify_crc = verify_crc
+
+        self.mmap = None
+        self.view = None
+        if use_mmap and os.fstat(self.file.fileno()).st_size > 0:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mmap)
+
+    def close(self):
+        """ Close the file and release the memory mapping, if any. """
+
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # Lazy frames still reference the mapping, it is released once they are gone.
+                pass
+            self.mmap = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_index(self):
+        """ Return the index of all frame records in the file.
+
+            Each entry holds the offset and length of the record as well as the timestamp,
+            the number of laser labels and the number of lasers of the frame.
+            The index is built on first use and persisted next to the file if use_index is set.
+        """
+
+        if self.index is None:
+            if self.use_index:
+                self.index = record_index.load_index(self.filename)
+
+            if self.index is None:
+                position = self.file.tell()
+                self.index = record_index.build_index(self)
+                self.file.seek(position,0)
+
+                if self.use_index:
+                    record_index.save_index(self.filename, self.index)
+
+        return self.index
 
     def get_record_table(self):
         """ Generate and return a table of the offset of all frame records in the file.
 
             This is particularly useful to determine the number of frames in the file
             and access random frames rather than read the file sequentially.
+            If use_index is set, the offsets are taken from the frame index (see get_index).
         """
 
+        if self.index is not None or self.use_index:
+            return [entry.offset for entry in self.get_index()]
+
         self.file.seek(0,0)
 
         table = []
@@ -52,21 +137,63 @@ class WaymoDataFileReader:
 
         self.file.seek(offset,0)
 
+    def seek_frame(self, frame_id):
+        """ Seek to a specific frame record by its position in the file.
+
+        The next call to reader.read_record() will return frame number frame_id.
+        """
+
+        self.seek(self.get_index()[frame_id].offset)
+
+    def read_frame(self, frame_id):
+        """ Read a specific frame record by its position in the file. """
+
+        self.seek_frame(frame_id)
+        return self.read_record()
+
+    def __len__(self):
+        return len(self.get_index())
+
     def read_record(self, header_only = False):
         """ Read the current frame record in the file.
 
         If repeatedly called, it will return sequential records until the end of file. When the end is reached, it will raise a StopIteration exception.
         To reset to the first frame, call reader.seek(0)
         """
-        
-        # TODO: Check CRCs.
 
+        data = self.read_record_bytes(header_only)
+
+        if header_only:
+            return None
+        elif self.lazy:
+            return LazyFrame(data)
+        else:
+            frame = dataset_pb2.Frame()
+            frame.ParseFromString(data)
+            return frame
+
+    def read_record_bytes(self, header_only = False):
+        """ Read the serialized payload of the current frame record in the file.
+
+        Returns a bytes object, or a memoryview slice of the mapped file if use_mmap is set.
+        Raises CorruptRecordError if the record is truncated or, with verify_crc, fails its CRC check.
+        A record whose payload fails the check is skipped, so reading can continue with the next one.
+        """
+
+        if self.mmap is not None:
+            return self._read_record_mmap(header_only)
+
+        offset = self.file.tell()
         header = self.file.read(12)
 
         if header == b'':
             raise StopIteration()
 
+        if len(header) < 12:
+            raise CorruptRecordError(self.filename, offset, "truncated header")
+
         length, lengthcrc = struct.unpack("QI", header)
+        self._check_crc(header[:8], lengthcrc, offset, "length crc mismatch")
 
 
         if header_only:
@@ -75,11 +202,53 @@ class WaymoDataFileReader:
             return None
         else:
             data = self.file.read(length)
-            datacrc = struct.unpack("I",self.file.read(4))
+            crc = self.file.read(4)
 
-            frame = dataset_pb2.Frame()
-            frame.ParseFromString(data)
-            return frame
+            if len(data) < length or len(crc) < 4:
+                raise CorruptRecordError(self.filename, offset, "truncated record")
+
+            datacrc, = struct.unpack("I",crc)
+            self._check_crc(data, datacrc, offset, "data crc mismatch")
+
+            return data
+
+    def _read_record_mmap(self, header_only):
+        """ Read the current frame record from the memory mapping.
+
+        The file object is only used to keep track of the current position so that seek() and
+        the record table work the same way in both modes.
+        """
+
+        offset = self.file.tell()
+
+        if offset >= len(self.mmap):
+            raise StopIteration()
+
+        if offset + 12 > len(self.mmap):
+            raise CorruptRecordError(self.filename, offset, "truncated header")
+
+        length, lengthcrc = struct.unpack_from("QI", self.mmap, offset)
+        self._check_crc(self.view[offset:offset+8], lengthcrc, offset, "length crc mismatch")
+        data_offset = offset + 12
+
+        if data_offset + length + 4 > len(self.mmap):
+            raise CorruptRecordError(self.filename, offset, "truncated record")
+
+        # Skip the payload and its CRC
+        self.file.seek(data_offset+length+4,0)
+
+        if header_only:
+            return None
+        else:
+            datacrc, = struct.unpack_from("I", self.mmap, data_offset+length)
+            data = self.view[data_offset:data_offset+length]
+            self._check_crc(data, datacrc, offset, "data crc mismatch")
+
+            return data
+
+    def _check_crc(self, data, expected_crc, offset, reason):
+        if self.verify_crc and masked_crc32c(data) != expected_crc:
+            raise CorruptRecordError(self.filename, offset, reason)
 
     def __iter__(self):
         """ Simple iterator through the file. Note that the iterator will iterate from the current position, does not support concurrent iterators and will not reset back to the beginning when the end is reached. To reset to the first frame, call reader.seek(0)
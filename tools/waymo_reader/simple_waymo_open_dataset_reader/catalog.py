@@ -0,0 +1,91 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import os
+from . import WaymoDataFileReader
+
+class DatasetCatalog:
+    """ Catalog of all tfrecord files (segments) in a directory.
+
+    The frame index of every segment is built (or loaded from its sidecar file) on construction,
+    so the catalog knows the global list of (segment, frame_id) pairs without reading any frame.
+    This list can be split into disjoint shards to process a dataset with several workers.
+    """
+
+    def __init__(self, directory, extension=".tfrecord", **reader_kwargs):
+        """ reader_kwargs are passed to WaymoDataFileReader when a segment is opened. """
+
+        self.directory = directory
+        self.reader_kwargs = dict(use_mmap=True, lazy=True)
+        self.reader_kwargs.update(reader_kwargs)
+
+        self.segments = sorted(f for f in os.listdir(directory) if f.endswith(extension))
+        self.indexes = {}
+        for segment in self.segments:
+            with WaymoDataFileReader(self.path(segment), use_index=self.reader_kwargs.get("use_index", True)) as reader:
+                self.indexes[segment] = reader.get_index()
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment)
+
+    def open(self, segment):
+        """ Open a segment with the reader options of the catalog. """
+
+        reader = WaymoDataFileReader(self.path(segment), **self.reader_kwargs)
+        reader.index = self.indexes[segment]
+        return reader
+
+    def num_frames(self, segment=None):
+        if segment is None:
+            return sum(len(index) for index in self.indexes.values())
+        return len(self.indexes[segment])
+
+    def __len__(self):
+        return self.num_frames()
+
+    def frames(self):
+        """ Return the list of all (segment, frame_id) pairs in the catalog. """
+
+        return [(segment, frame_id) for segment in self.segments for frame_id in range(len(self.indexes[segment]))]
+
+    def shard(self, shard_id, num_shards):
+        """ Return the (segment, frame_id) pairs of shard shard_id out of num_shards.
+
+        Shards are contiguous and their sizes differ by at most one frame, so each worker reads
+        its frames sequentially and shards 0..num_shards-1 together cover every frame once.
+        """
+
+        if not 0 <= shard_id < num_shards:
+            raise ValueError("Invalid shard {} of {}".format(shard_id, num_shards))
+
+        frames = self.frames()
+        start = len(frames) * shard_id // num_shards
+        end = len(frames) * (shard_id + 1) // num_shards
+        return frames[start:end]
+
+    def iter_shard(self, shard_id, num_shards):
+        """ Iterate over the frames of a shard, yielding (segment, frame_id, frame) tuples. """
+
+        reader = None
+        try:
+            for segment, frame_id in self.shard(shard_id, num_shards):
+                if reader is None or reader.filename != self.path(segment):
+                    if reader is not None:
+                        reader.close()
+                    reader = self.open(segment)
+                yield segment, frame_id, reader.read_frame(frame_id)
+        finally:
+            if reader is not None:
+                reader.close()
@@ -0,0 +1,100 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import numpy as np
+
+# Use a native (SSE4.2 / ARMv8) CRC32C implementation if one is installed.
+try:
+    import crc32c as _crc32c_module
+    _native_crc32c = _crc32c_module.crc32c
+except ImportError:
+    try:
+        import google_crc32c as _crc32c_module
+        _native_crc32c = lambda data: _crc32c_module.value(bytes(data))
+    except ImportError:
+        _native_crc32c = None
+
+CRC32C_POLY = 0x82f63b78 # reversed Castagnoli polynomial
+MASK_DELTA = 0xa282ead8
+CHUNK_SIZE = 1024
+
+def _make_table():
+    table = np.arange(256, dtype=np.uint32)
+    for _ in range(8):
+        table = np.where(table & 1, (table >> 1) ^ np.uint32(CRC32C_POLY), table >> 1).astype(np.uint32)
+    return table
+
+_TABLE = _make_table()
+_shift_tables = {}
+
+def _update(register, data_steps):
+    """ Feed bytes into CRC registers, one row of data_steps per step. """
+
+    for step in data_steps:
+        register = _TABLE[(register ^ step) & 0xff] ^ (register >> 8)
+    return register
+
+def _get_shift_tables(length):
+    """ Tables to advance a CRC register over length zero bytes with 4 byte-wise lookups. """
+
+    if length not in _shift_tables:
+        values = np.arange(256, dtype=np.uint32)
+        registers = np.concatenate([values << np.uint32(8*k) for k in range(4)])
+        registers = _update(registers, np.zeros((length, 1), dtype=np.uint32))
+        _shift_tables[length] = registers.reshape(4, 256).tolist()
+    return _shift_tables[length]
+
+def _crc32c_numpy(data):
+    """ Vectorized CRC32C fallback.
+
+    The payload is split into chunks whose raw CRCs are computed in parallel with numpy. As the
+    CRC is linear, the chunk CRCs are then combined by advancing the running register over the
+    length of each chunk.
+    """
+
+    data = np.frombuffer(data, dtype=np.uint8)
+    num_chunks = len(data) // CHUNK_SIZE
+    head = len(data) - num_chunks * CHUNK_SIZE
+
+    register = 0xffffffff
+    for byte in data[:head].tolist():
+        register = int(_TABLE[(register ^ byte) & 0xff]) ^ (register >> 8)
+
+    if num_chunks > 0:
+        chunks = data[head:].reshape(num_chunks, CHUNK_SIZE).T.astype(np.uint32)
+        chunk_crcs = _update(np.zeros(num_chunks, dtype=np.uint32), chunks).tolist()
+
+        t0, t1, t2, t3 = _get_shift_tables(CHUNK_SIZE)
+        for chunk_crc in chunk_crcs:
+            register = (t0[register & 0xff] ^ t1[(register >> 8) & 0xff]
+                        ^ t2[(register >> 16) & 0xff] ^ t3[register >> 24] ^ chunk_crc)
+
+    return register ^ 0xffffffff
+
+def crc32c(data):
+    """ Compute the CRC32C (Castagnoli) checksum of a bytes-like object. """
+
+    if _native_crc32c is not None:
+        return _native_crc32c(data)
+    return _crc32c_numpy(data)
+
+def masked_crc32c(data):
+    """ Compute the masked CRC32C checksum used by the tfrecord format. """
+
+    crc = crc32c(data)
+    return ((((crc >> 15) | (crc << 17)) & 0xffffffff) + MASK_DELTA) & 0xffffffff
+
+def has_native_crc32c():
+    return _native_crc32c is not None
@@ -0,0 +1,254 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import struct
+from google.protobuf import descriptor
+from . import dataset_pb2
+
+WIRETYPE_VARINT = 0
+WIRETYPE_FIXED64 = 1
+WIRETYPE_LENGTH_DELIMITED = 2
+WIRETYPE_FIXED32 = 5
+
+def read_varint(buffer, pos):
+    """ Decode a base 128 varint starting at buffer[pos]. Return the value and the position after it. """
+
+    result = 0
+    shift = 0
+    while True:
+        b = buffer[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def scan_fields(buffer, start=0, end=None):
+    """ Index the top-level fields of a serialized protobuf message without decoding them.
+
+    Return a dict mapping each field number to a list of (wire_type, value) tuples in the order
+    in which they appear. For varints, value is the decoded integer. For all other wire types,
+    value is the (start, end) span of the payload in the buffer.
+    """
+
+    if end is None:
+        end = len(buffer)
+
+    fields = {}
+    pos = start
+
+    while pos < end:
+        key, pos = read_varint(buffer, pos)
+        number = key >> 3
+        wire_type = key & 0x7
+
+        if wire_type == WIRETYPE_VARINT:
+            value, pos = read_varint(buffer, pos)
+        elif wire_type == WIRETYPE_FIXED64:
+            value = (pos, pos+8)
+            pos += 8
+        elif wire_type == WIRETYPE_LENGTH_DELIMITED:
+            length, pos = read_varint(buffer, pos)
+            value = (pos, pos+length)
+            pos += length
+        elif wire_type == WIRETYPE_FIXED32:
+            value = (pos, pos+4)
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type {} for field {}".format(wire_type, number))
+
+        fields.setdefault(number, []).append((wire_type, value))
+
+    if pos != end:
+        raise ValueError("Truncated protobuf message")
+
+    return fields
+
+def _decode_scalar(field, buffer, wire_type, value):
+    if wire_type == WIRETYPE_VARINT:
+        if field.type in (descriptor.FieldDescriptor.TYPE_INT64, descriptor.FieldDescriptor.TYPE_INT32,
+                          descriptor.FieldDescriptor.TYPE_ENUM) and value >= 1 << 63:
+            value -= 1 << 64
+        if field.type == descriptor.FieldDescriptor.TYPE_BOOL:
+            value = bool(value)
+        return value
+
+    start, end = value
+    if field.type == descriptor.FieldDescriptor.TYPE_DOUBLE:
+        return struct.unpack_from("<d", buffer, start)[0]
+    if field.type == descriptor.FieldDescriptor.TYPE_FLOAT:
+        return struct.unpack_from("<f", buffer, start)[0]
+    if field.type == descriptor.FieldDescriptor.TYPE_STRING:
+        return bytes(buffer[start:end]).decode("utf-8")
+    if field.type == descriptor.FieldDescriptor.TYPE_BYTES:
+        return bytes(buffer[start:end])
+
+    raise ValueError("Unsupported lazy decoding of field {}".format(field.name))
+
+_PACKED_FIXED_FORMATS = {
+    descriptor.FieldDescriptor.TYPE_DOUBLE: "d",
+    descriptor.FieldDescriptor.TYPE_FLOAT: "f",
+}
+
+def _decode_repeated_scalar(field, buffer, wire_type, value):
+    """ Decode one occurrence of a repeated scalar field into a list of values.
+
+    A length-delimited occurrence of a numeric field is a packed run of values, all of which are decoded.
+    """
+
+    if wire_type != WIRETYPE_LENGTH_DELIMITED or field.type in (descriptor.FieldDescriptor.TYPE_STRING,
+                                                                 descriptor.FieldDescriptor.TYPE_BYTES):
+        return [_decode_scalar(field, buffer, wire_type, value)]
+
+    start, end = value
+    if field.type in _PACKED_FIXED_FORMATS:
+        fmt = _PACKED_FIXED_FORMATS[field.type]
+        return list(struct.unpack_from("<{}{}".format((end - start) // struct.calcsize(fmt), fmt), buffer, start))
+
+    values = []
+    pos = start
+    while pos < end:
+        item, pos = read_varint(buffer, pos)
+        values.append(_decode_scalar(field, buffer, WIRETYPE_VARINT, item))
+    return values
+
+class LazyRepeatedField:
+    """ Read-only sequence over a repeated message field which parses its items on first access. """
+
+    def __init__(self, message_class, buffer, spans):
+        self.message_class = message_class
+        self.buffer = buffer
+        self.spans = spans
+        self.items = [None] * len(spans)
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        item = self.items[index]
+        if item is None:
+            start, end = self.spans[index]
+            item = self.message_class()
+            item.ParseFromString(self.buffer[start:end])
+            self.items[index] = item
+        return item
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def find_by_name(self, name):
+        """ Return the first item whose "name" field equals name, or None.
+
+        Only the name of each item is decoded, the other items are not parsed.
+        """
+
+        name_field = self.message_class.DESCRIPTOR.fields_by_name["name"]
+
+        for index, (start, end) in enumerate(self.spans):
+            fields = scan_fields(self.buffer, start, end)
+            item_name = fields.get(name_field.number, [(WIRETYPE_VARINT, name_field.default_value)])[-1][1]
+            if item_name == name:
+                return self[index]
+
+        return None
+
+def _message_field_classes(message):
+    classes = {}
+    for field in message.DESCRIPTOR.fields:
+        if field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+            if field.label == descriptor.FieldDescriptor.LABEL_REPEATED:
+                classes[field.name] = type(getattr(message, field.name).add())
+            else:
+                classes[field.name] = type(getattr(message, field.name))
+    return classes
+
+_FRAME_FIELD_CLASSES = _message_field_classes(dataset_pb2.Frame())
+
+class LazyFrame:
+    """ Read-only view of a serialized dataset_pb2.Frame which decodes fields on first access.
+
+    The offsets of the top-level fields are indexed once on construction. Accessing a field,
+    e.g. frame.laser_labels or frame.context, only parses that field. Repeated message fields
+    such as frame.lasers or frame.images are returned as LazyRepeatedField which only parses
+    the items which are accessed.
+
+    Any other attribute of dataset_pb2.Frame (e.g. ListFields) is served by a fully parsed frame.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._fields = scan_fields(buffer)
+        self._frame = None
+
+    def __getattr__(self, name):
+        field = dataset_pb2.Frame.DESCRIPTOR.fields_by_name.get(name)
+
+        if field is None:
+            if name.startswith("_"):
+                raise AttributeError(name)
+            return getattr(self.to_frame(), name)
+
+        value = self._decode_field(field)
+
+        # Cache the decoded value as a regular attribute so that __getattr__ is not called again.
+        self.__dict__[name] = value
+        return value
+
+    def _decode_field(self, field):
+        entries = self._fields.get(field.number, [])
+        repeated = field.label == descriptor.FieldDescriptor.LABEL_REPEATED
+
+        if field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+            message_class = _FRAME_FIELD_CLASSES[field.name]
+
+            if repeated:
+                return LazyRepeatedField(message_class, self._buffer, [value for _, value in entries])
+
+            # Like protobuf, merge all occurrences of a singular message field.
+            message = message_class()
+            for _, (start, end) in entries:
+                message.MergeFromString(self._buffer[start:end])
+            return message
+
+        if repeated:
+            return [item for wire_type, value in entries
+                    for item in _decode_repeated_scalar(field, self._buffer, wire_type, value)]
+
+        if not entries:
+            return field.default_value
+
+        wire_type, value = entries[-1]
+        return _decode_scalar(field, self._buffer, wire_type, value)
+
+    def HasField(self, name):
+        return dataset_pb2.Frame.DESCRIPTOR.fields_by_name[name].number in self._fields
+
+    def SerializeToString(self):
+        return bytes(self._buffer)
+
+    def to_frame(self):
+        """ Return the fully parsed dataset_pb2.Frame. """
+
+        if self._frame is None:
+            self._frame = dataset_pb2.Frame()
+            self._frame.ParseFromString(self._buffer)
+        return self._frame
+
+    def __reduce__(self):
+        return (LazyFrame, (bytes(self._buffer),))
@@ -0,0 +1,106 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import numpy as np
+from . import dataset_pb2
+from .lazy_frame import scan_fields, read_varint, WIRETYPE_VARINT, WIRETYPE_LENGTH_DELIMITED
+
+# Field numbers shared by MatrixFloat and MatrixInt32
+DATA_FIELD = dataset_pb2.MatrixFloat.DESCRIPTOR.fields_by_name["data"].number
+SHAPE_FIELD = dataset_pb2.MatrixFloat.DESCRIPTOR.fields_by_name["shape"].number
+DIMS_FIELD = dataset_pb2.MatrixShape.DESCRIPTOR.fields_by_name["dims"].number
+
+def _decode_shape(buffer, fields):
+    dims = []
+    for _, (start, end) in fields.get(SHAPE_FIELD, []):
+        for wire_type, value in scan_fields(buffer, start, end).get(DIMS_FIELD, []):
+            if wire_type == WIRETYPE_VARINT:
+                dims.append(value)
+            else:
+                pos, end = value
+                while pos < end:
+                    dim, pos = read_varint(buffer, pos)
+                    dims.append(dim)
+    return dims
+
+def _packed_spans(fields):
+    """ Return the spans of the data field, or None if it is not (only) encoded as packed. """
+
+    entries = fields.get(DATA_FIELD, [])
+    if any(wire_type != WIRETYPE_LENGTH_DELIMITED for wire_type, _ in entries):
+        return None
+    return [span for _, span in entries]
+
+def decode_varints(data):
+    """ Decode a packed sequence of base 128 varints held in a uint8 array with numpy.
+
+    Return the values as int64, interpreting 10-byte varints as negative numbers.
+    """
+
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    last_bytes = data < 0x80
+    if not last_bytes[-1]:
+        raise ValueError("Truncated varint")
+
+    # Index of the first byte of each varint and position of every byte within its varint
+    starts = np.concatenate(([0], np.flatnonzero(last_bytes[:-1]) + 1))
+    varint_ids = np.cumsum(last_bytes) - last_bytes
+    positions = np.arange(len(data)) - starts[varint_ids]
+
+    groups = (data & 0x7f).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    return np.bitwise_or.reduceat(groups, starts).view(np.int64)
+
+def decode_matrix_float(buffer):
+    """ Decode a serialized MatrixFloat into a float32 numpy array of shape shape.dims.
+
+    The packed data field is interpreted in place with np.frombuffer, so the returned array is a
+    read-only view of buffer (unless the data is split into several chunks, which is then copied).
+    Falls back to a protobuf parse if the data field is not packed.
+    """
+
+    fields = scan_fields(buffer)
+    spans = _packed_spans(fields)
+
+    if spans is None:
+        matrix = dataset_pb2.MatrixFloat()
+        matrix.ParseFromString(buffer)
+        return np.array(matrix.data, dtype=np.float32).reshape(matrix.shape.dims)
+
+    chunks = [np.frombuffer(buffer, dtype="<f4", count=(end - start) // 4, offset=start) for start, end in spans]
+    data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks or [np.zeros(0, dtype=np.float32)])
+
+    return data.reshape(_decode_shape(buffer, fields))
+
+def decode_matrix_int32(buffer):
+    """ Decode a serialized MatrixInt32 into an int32 numpy array of shape shape.dims.
+
+    The varints of the packed data field are decoded with vectorized numpy operations.
+    Falls back to a protobuf parse if the data field is not packed.
+    """
+
+    fields = scan_fields(buffer)
+    spans = _packed_spans(fields)
+
+    if spans is None:
+        matrix = dataset_pb2.MatrixInt32()
+        matrix.ParseFromString(buffer)
+        return np.array(matrix.data, dtype=np.int32).reshape(matrix.shape.dims)
+
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    data = np.concatenate([decode_varints(raw[start:end]) for start, end in spans] or [np.zeros(0, dtype=np.int64)])
+
+    return data.astype(np.int32).reshape(_decode_shape(buffer, fields))
@@ -0,0 +1,110 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import collections
+import threading
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+def range_image_key(frame, laser_name, second_response=False):
+    """ Return the cache key of a range image: (segment, frame timestamp, laser, return). """
+
+    return (frame.context.name, frame.timestamp_micros, laser_name, 2 if second_response else 1)
+
+def _nbytes(value):
+    return sum(array.nbytes for array in value if array is not None)
+
+class RangeImageCache:
+    """ LRU cache of decoded range images with a memory budget.
+
+    Values are tuples of numpy arrays (range image, camera projection, range image pose) which
+    are marked read-only, as they are shared between all the consumers of a range image.
+    The least recently used entries are evicted when the total size of the cached arrays
+    exceeds max_bytes. A value larger than max_bytes is returned but not cached.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """ Return the cached value for key, or None. """
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """ Make the arrays of value read-only and add it to the cache. Return value. """
+
+        for array in value:
+            if array is not None:
+                array.flags.writeable = False
+
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= _nbytes(self._entries.pop(key))
+            self._entries[key] = value
+            self.nbytes += size
+            self._evict()
+
+        return value
+
+    def get_or_decode(self, key, decode):
+        """ Return the cached value for key, calling decode() to compute it on a miss. """
+
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, decode())
+        return value
+
+    def resize(self, max_bytes):
+        """ Change the memory budget, evicting entries if needed. """
+
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._entries:
+            _, value = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(value)
+
+# Cache shared by all the range image consumers of a process.
+default_cache = RangeImageCache()
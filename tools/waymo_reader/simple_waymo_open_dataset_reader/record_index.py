@@ -0,0 +1,110 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import collections
+import json
+import os
+from .lazy_frame import LazyFrame
+
+INDEX_SUFFIX = ".index"
+INDEX_VERSION = 1
+
+RecordIndexEntry = collections.namedtuple("RecordIndexEntry",
+        ["offset", "length", "timestamp_micros", "num_laser_labels", "num_lasers"])
+
+def index_filename(filename):
+    """ Return the path of the index sidecar file for a given tfrecord file. """
+
+    return filename + INDEX_SUFFIX
+
+def _file_signature(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+def load_index(filename):
+    """ Load the index sidecar of a tfrecord file.
+
+    Returns None if there is no index or if it is stale, i.e. the size or modification time
+    of the tfrecord file does not match the values recorded when the index was written.
+    """
+
+    try:
+        with open(index_filename(filename), "r") as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    size, mtime_ns = _file_signature(filename)
+
+    if (content.get("version") != INDEX_VERSION
+            or content.get("size") != size
+            or content.get("mtime_ns") != mtime_ns):
+        return None
+
+    return [RecordIndexEntry(*record) for record in content["records"]]
+
+def save_index(filename, entries):
+    """ Write the index sidecar of a tfrecord file next to it.
+
+    Returns False if the sidecar could not be written (e.g. read-only dataset directory).
+    """
+
+    size, mtime_ns = _file_signature(filename)
+    content = {
+        "version": INDEX_VERSION,
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "records": [list(entry) for entry in entries]}
+
+    # Write to a temporary file first so that concurrent readers never see a partial index.
+    tmp_filename = index_filename(filename) + ".tmp{}".format(os.getpid())
+    try:
+        with open(tmp_filename, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp_filename, index_filename(filename))
+    except OSError:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        return False
+
+    return True
+
+def build_index(reader):
+    """ Scan all the frame records of a reader and return their index entries.
+
+    Frames are not fully parsed, only the wire-format fields needed for the index are decoded.
+    The position of the reader is reset to the beginning of the file afterwards.
+    """
+
+    reader.seek(0)
+
+    entries = []
+
+    while True:
+        offset = reader.file.tell()
+
+        try:
+            data = reader.read_record_bytes()
+        except StopIteration:
+            break
+
+        frame = LazyFrame(data)
+        length = len(data)
+        entries.append(RecordIndexEntry(offset, length, frame.timestamp_micros,
+                                        len(frame.laser_labels), len(frame.lasers)))
+
+    reader.seek(0)
+
+    return entries
@@ -26,7 +26,7 @@ SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.
 sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 
 # from simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
-from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, label_pb2
+from tools.waymo_reader.simple_waymo_open_dataset_reader import dataset_pb2, label_pb2, matrix, range_image_cache
 
 
 
@@ -191,55 +191,71 @@ def get_image_transform(camera_calibration):
     vehicle_to_image = np.matmul(camera_model, np.matmul(axes_transformation, np.linalg.inv(extrinsic)))
     return vehicle_to_image
 
-def parse_range_image_and_camera_projection(laser, second_response=False):
-    """ Parse the range image for a given laser.
-
-    second_response: If true, return the second strongest response instead of the primary response.
-                     The second_response might be useful to detect the edge of objects
-    """
+def _decode_range_image(laser, second_response):
+    """ Decompress and parse the range image, camera projection and range image pose of a laser. """
 
+    ri = None
     range_image_pose = None
     camera_projection = None
 
     if not second_response:
         # Return the strongest response if available
         if len(laser.ri_return1.range_image_compressed) > 0:
-            ri = dataset_pb2.MatrixFloat()
-            ri.ParseFromString(
+            ri = matrix.decode_matrix_float(
                 zlib.decompress(laser.ri_return1.range_image_compressed))
-            ri = np.array(ri.data).reshape(ri.shape.dims)
 
             if laser.name == dataset_pb2.LaserName.TOP:
-                range_image_top_pose = dataset_pb2.MatrixFloat()
-                range_image_top_pose.ParseFromString(
+                range_image_pose = matrix.decode_matrix_float(
                     zlib.decompress(laser.ri_return1.range_image_pose_compressed))
-                range_image_pose = np.array(range_image_top_pose.data).reshape(range_image_top_pose.shape.dims)
                 
-            camera_projection = dataset_pb2.MatrixInt32()
-            camera_projection.ParseFromString(
+            camera_projection = matrix.decode_matrix_int32(
                     zlib.decompress(laser.ri_return1.camera_projection_compressed))
-            camera_projection = np.array(camera_projection.data).reshape(camera_projection.shape.dims)
 
     else:
         # Return the second strongest response if available
 
         if len(laser.ri_return2.range_image_compressed) > 0:
-            ri = dataset_pb2.MatrixFloat()
-            ri.ParseFromString(
+            ri = matrix.decode_matrix_float(
                 zlib.decompress(laser.ri_return2.range_image_compressed))
-            ri = np.array(ri.data).reshape(ri.shape.dims)
                 
-            camera_projection = dataset_pb2.MatrixInt32()
-            camera_projection.ParseFromString(
+            camera_projection = matrix.decode_matrix_int32(
                     zlib.decompress(laser.ri_return2.camera_projection_compressed))
-            camera_projection = np.array(camera_projection.data).reshape(camera_projection.shape.dims)
 
     return ri, camera_projection, range_image_pose
 
+def parse_range_image_and_camera_projection(laser, second_response=False, frame=None, cache=None):
+    """ Parse the range image for a given laser.
+
+    second_response: If true, return the second strongest response instead of the primary response.
+                     The second_response might be useful to detect the edge of objects
+    frame: The frame containing the laser. If given, the decoded arrays are looked up in and added
+           to the range image cache (range_image_cache.default_cache unless cache is given), so that
+           a range image is only decoded once per frame. Cached arrays are read-only.
+
+    The range image and the range image pose are float32 arrays, the camera projection is an int32 array.
+    The float arrays are read-only views of the decompressed data.
+    """
+
+    if frame is None:
+        return _decode_range_image(laser, second_response)
+
+    if cache is None:
+        cache = range_image_cache.default_cache
+
+    key = range_image_cache.range_image_key(frame, laser.name, second_response)
+    return cache.get_or_decode(key, lambda: _decode_range_image(laser, second_response))
+
 
 def get(object_list, name):
     """ Search for an object by name in an object list. """
 
+    if hasattr(object_list, 'find_by_name'):
+        # Lazy repeated field: only parse the matching object
+        obj = object_list.find_by_name(name)
+        if obj is None:
+            raise IndexError("No object named {}".format(name))
+        return obj
+
     object_list = [obj for obj in object_list if obj.name == name]
     return object_list[0]
 
@@ -0,0 +1,70 @@
+# Copyright (c) 2019, Grégoire Payen de La Garanderie, Durham University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import multiprocessing
+import os
+import sys
+from . import WaymoDataFileReader, CorruptRecordError
+
+def verify_file(filename):
+    """ Check the CRCs of all records in a tfrecord file.
+
+    Return a list of (offset, reason) tuples for all bad records. Scanning stops at the first
+    bad header or truncated record as the position of the following records is unknown.
+    """
+
+    bad_records = []
+
+    with WaymoDataFileReader(filename, use_index=False, use_mmap=True, verify_crc=True) as reader:
+        while True:
+            try:
+                reader.read_record_bytes()
+            except StopIteration:
+                break
+            except CorruptRecordError as e:
+                bad_records.append((e.offset, e.reason))
+                if e.reason != "data crc mismatch":
+                    break
+
+    return bad_records
+
+def verify_segment(path, num_workers=None):
+    """ Check the CRCs of a tfrecord file or of all tfrecord files in a directory.
+
+    The files are checked in parallel by num_workers processes (default: number of CPUs).
+    Return a dict mapping each file to the list of (offset, reason) tuples of its bad records.
+    """
+
+    if os.path.isdir(path):
+        filenames = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".tfrecord"))
+    else:
+        filenames = [path]
+
+    if len(filenames) <= 1 or num_workers == 1:
+        results = [verify_file(f) for f in filenames]
+    else:
+        with multiprocessing.Pool(min(num_workers or os.cpu_count(), len(filenames))) as pool:
+            results = pool.map(verify_file, filenames)
+
+    return dict(zip(filenames, results))
+
+if __name__ == "__main__":
+    report = verify_segment(sys.argv[1] if len(sys.argv) > 1 else ".")
+    for filename, bad_records in report.items():
+        status = "OK" if not bad_records else "{} bad record(s)".format(len(bad_records))
+        print("{}: {}".format(filename, status))
+        for offset, reason in bad_records:
+            print("    offset {}: {}".format(offset, reason))
+    sys.exit(1 if any(report.values()) else 0)